@@ -0,0 +1,3 @@
+#!/bin/bash
+
+python3 src/benchmark.py suite "$@"
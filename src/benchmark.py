@@ -0,0 +1,464 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tomllib
+import argparse
+import datetime
+import platform
+import resource
+import tempfile
+import contextlib
+import tracemalloc
+from classes import BlockType
+from functions import (
+    text_to_textnodes,
+    markdown_to_blocks,
+    block_to_blocktype,
+    markdown_to_html_node,
+)
+from main import main as build_main
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE_PATH = os.path.join(ROOT_DIR, "template.html")
+
+INLINE_SPANS = [
+    lambda n: f"**bold {n}**",
+    lambda n: f"_italic {n}_",
+    lambda n: f"`code {n}`",
+    lambda n: f"[link {n}](https://example.com/{n})",
+    lambda n: f"![image {n}](/images/{n}.png)",
+]
+
+
+# Unclosed brackets that make a backtracking link or image pattern rescan the
+# rest of the paragraph from every "[" or "!"
+ADVERSARIAL_INLINE = {
+    "unmatched [x]": "[a] ",
+    "link without )": "x [a](b ",
+    "image without (": "![a] ",
+    "nested [x](": "[a](",
+}
+
+
+def make_inline_paragraph(spans, seed=0):
+    rng = random.Random(seed)
+    parts = []
+    for n in range(spans):
+        parts.append(f"plain words {n} ")
+        parts.append(rng.choice(INLINE_SPANS)(n))
+    parts.append(" the end")
+    return "".join(parts)
+
+
+BLOCK_KINDS = [
+    "heading",
+    "paragraph",
+    "unordered_list",
+    "ordered_list",
+    "quote",
+    "code",
+]
+DEFAULT_MIX = {kind: 1 for kind in BLOCK_KINDS}
+
+
+def make_block(kind, n, rng, spans):
+    match kind:
+        case "heading":
+            return f"{'#' * rng.randint(2, 6)} Section {n}"
+        case "paragraph":
+            return make_inline_paragraph(rng.randint(*spans), seed=n)
+        case "unordered_list":
+            return "\n".join(f"- item {n}.{i} with **bold**" for i in range(5))
+        case "ordered_list":
+            return "\n".join(f"{i}. step {n}.{i}" for i in range(1, 6))
+        case "quote":
+            return f"> quoted _text_ {n}\n> and [a link](/blog/{n})"
+        case "code":
+            return f"```\ndef f{n}():\n    return {n}\n```"
+        case _:
+            raise ValueError(f"Unknown block kind: {kind}")
+
+
+def make_document(blocks, seed=0, mix=DEFAULT_MIX, spans=(5, 20)):
+    rng = random.Random(seed)
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    parts = [f"# Benchmark document {seed}"]
+    for n in range(blocks):
+        parts.append(make_block(rng.choices(kinds, weights)[0], n, rng, spans))
+    return "\n\n".join(parts)
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(","):
+        kind, _, weight = item.partition("=")
+        if kind not in BLOCK_KINDS:
+            raise argparse.ArgumentTypeError(f"unknown block kind: {kind}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def make_site(root, pages, blocks, mix=DEFAULT_MIX, spans=(5, 20)):
+    content = os.path.join(root, "content")
+    for n in range(pages):
+        # Spread pages over nested directories like a real blog
+        page_dir = os.path.join(content, f"section{n % 10}", f"page{n}")
+        os.makedirs(page_dir, exist_ok=True)
+        with open(os.path.join(page_dir, "index.md"), "w") as f:
+            f.write(make_document(blocks, seed=n, mix=mix, spans=spans))
+
+    with open(os.path.join(content, "index.md"), "w") as f:
+        f.write(make_document(blocks, mix=mix, spans=spans))
+
+    os.makedirs(os.path.join(root, "static", "images"), exist_ok=True)
+    with open(os.path.join(root, "static", "index.css"), "w") as f:
+        f.write("body { margin: 0 }\n")
+    for n in range(10):
+        with open(os.path.join(root, "static", "images", f"{n}.png"), "wb") as f:
+            f.write(os.urandom(4096))
+
+    shutil.copy(TEMPLATE_PATH, os.path.join(root, "template.html"))
+
+
+def best_time(func, *args, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_inline(span_counts, repeat):
+    print(f"{'spans':>8} {'legacy (ms)':>12} {'single pass (ms)':>17} {'speedup':>8}")
+    for spans in span_counts:
+        text = make_inline_paragraph(spans)
+        legacy_nodes = text_to_textnodes(text, legacy=True)
+        if legacy_nodes != text_to_textnodes(text, legacy=False):
+            raise Exception(f"Inline pipelines disagree on {spans} spans")
+
+        legacy = best_time(text_to_textnodes, text, True, repeat=repeat)
+        single_pass = best_time(text_to_textnodes, text, False, repeat=repeat)
+        print(
+            f"{spans:>8} {legacy * 1000:>12.2f} {single_pass * 1000:>17.2f}"
+            f" {legacy / single_pass:>7.1f}x"
+        )
+
+    # Both pipelines must stay linear on input like this, not just on prose
+    print(f"\n{'adversarial (8 kB)':<18} {'legacy (ms)':>12} {'single pass (ms)':>17}")
+    for name, unit in ADVERSARIAL_INLINE.items():
+        text = unit * (8000 // len(unit))
+        if text_to_textnodes(text, legacy=True) != text_to_textnodes(
+            text, legacy=False
+        ):
+            raise Exception(f"Inline pipelines disagree on {name!r}")
+
+        legacy = best_time(text_to_textnodes, text, True, repeat=repeat)
+        single_pass = best_time(text_to_textnodes, text, False, repeat=repeat)
+        print(f"{name:<18} {legacy * 1000:>12.2f} {single_pass * 1000:>17.2f}")
+
+
+# The if/elif chain block_to_blocktype used to be, kept as the baseline
+def legacy_block_to_blocktype(block):
+    if block.startswith("# ") and "\n" not in block:
+        return BlockType.HEADING
+    elif block.startswith("## ") and "\n" not in block:
+        return BlockType.HEADING
+    elif block.startswith("### ") and "\n" not in block:
+        return BlockType.HEADING
+    elif block.startswith("#### ") and "\n" not in block:
+        return BlockType.HEADING
+    elif block.startswith("##### ") and "\n" not in block:
+        return BlockType.HEADING
+    elif block.startswith("###### ") and "\n" not in block:
+        return BlockType.HEADING
+
+    elif block.startswith("```") and block.endswith("```"):
+        return BlockType.CODE
+
+    elif block.startswith("> "):
+        lines = block.split("\n")
+        if all(line.startswith(">") for line in lines):
+            return BlockType.QUOTE
+
+    elif block.startswith("- "):
+        lines = block.split("\n")
+        if all(map(lambda x: x.startswith("- "), lines)):
+            return BlockType.UNORDERED_LIST
+
+    elif block[0] == "1" and block[1] == ".":
+        lines = block.split("\n")
+        if all(map(lambda x: x[0].isdigit() and x[1] == ".", lines)):
+            nums = []
+            for line in lines:
+                nums.append(int(line.split(".")[0]))
+            if nums == list(range(1, len(nums) + 1)):
+                return BlockType.ORDERED_LIST
+
+    else:
+        return BlockType.PARAGRAPH
+
+
+def bench_classify(count, repeat):
+    rng = random.Random(0)
+    kinds = list(DEFAULT_MIX)
+    samples = [make_block(kind, n, rng, (5, 20)) for n, kind in enumerate(kinds * 50)]
+    for block in samples:
+        if legacy_block_to_blocktype(block) != block_to_blocktype(block):
+            raise Exception(f"Block classifiers disagree on {block!r}")
+    blocks = [samples[n % len(samples)] for n in range(count)]
+
+    def classify(func):
+        for block in blocks:
+            func(block)
+
+    legacy = best_time(classify, legacy_block_to_blocktype, repeat=repeat)
+    table = best_time(classify, block_to_blocktype, repeat=repeat)
+    print(f"{'blocks':>10} {'if/elif (ms)':>13} {'table (ms)':>11} {'speedup':>8}")
+    print(
+        f"{count:>10} {legacy * 1000:>13.1f} {table * 1000:>11.1f}"
+        f" {legacy / table:>7.1f}x"
+    )
+
+
+def measure(func, repeat):
+    seconds = best_time(func, repeat=repeat)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def bench_render(blocks, repeat):
+    markdown = make_document(blocks)
+    html_node = markdown_to_html_node(markdown)
+
+    def render_to_file():
+        with open(os.devnull, "w") as f:
+            html_node.render_into(f.write)
+
+    print(f"document: {len(markdown) / 1e6:.1f} MB markdown, {blocks} blocks")
+    print(f"output:   {len(html_node.to_html()) / 1e6:.1f} MB html")
+    print(f"{'':>20} {'time (ms)':>10} {'peak alloc (MB)':>16}")
+    for name, func in [
+        ("to_html()", html_node.to_html),
+        ("render_into(file)", render_to_file),
+    ]:
+        seconds, peak = measure(func, repeat)
+        print(f"{name:>20} {seconds * 1000:>10.1f} {peak / 1e6:>16.1f}")
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+
+
+def bench_memory(blocks):
+    markdown = make_document(blocks)
+    before = peak_rss_mb()
+
+    start = time.perf_counter()
+    html_node = markdown_to_html_node(markdown)
+    seconds = time.perf_counter() - start
+
+    after = peak_rss_mb()
+    print(f"document:      {len(markdown) / 1e6:.1f} MB markdown, {blocks} blocks")
+    print(f"parse:         {seconds * 1000:.1f} ms")
+    print(f"peak RSS:      {after:.1f} MB")
+    print(f"tree growth:   {after - before:.1f} MB")
+
+
+def bench_suite(pages, blocks, mix, spans, repeat, jobs):
+    results = {}
+
+    def record(stage, func, count):
+        seconds = best_time(func, repeat=repeat)
+        results[stage] = {"seconds": seconds, "calls": count}
+        print(
+            f"{stage:>20} {seconds * 1000:>10.1f} ms  ({count} calls)", file=sys.stderr
+        )
+
+    with tempfile.TemporaryDirectory() as root:
+        make_site(root, pages, blocks, mix, spans)
+        markdowns = []
+        for dir_path, _, file_names in sorted(os.walk(os.path.join(root, "content"))):
+            for name in sorted(file_names):
+                with open(os.path.join(dir_path, name), "r") as f:
+                    markdowns.append(f.read())
+
+        page_blocks = [markdown_to_blocks(markdown) for markdown in markdowns]
+        all_blocks = [block for page in page_blocks for block in page]
+        paragraphs = [
+            " ".join(line.strip() for line in block.split("\n"))
+            for block in all_blocks
+            if block_to_blocktype(block) == BlockType.PARAGRAPH
+        ]
+        trees = [markdown_to_html_node(markdown) for markdown in markdowns]
+
+        record(
+            "markdown_to_blocks",
+            lambda: [markdown_to_blocks(markdown) for markdown in markdowns],
+            len(markdowns),
+        )
+        record(
+            "block_to_blocktype",
+            lambda: [block_to_blocktype(block) for block in all_blocks],
+            len(all_blocks),
+        )
+        record(
+            "text_to_textnodes",
+            lambda: [text_to_textnodes(text) for text in paragraphs],
+            len(paragraphs),
+        )
+        record(
+            "markdown_to_html_node",
+            lambda: [markdown_to_html_node(markdown) for markdown in markdowns],
+            len(markdowns),
+        )
+        record("to_html", lambda: [tree.to_html() for tree in trees], len(trees))
+
+        def full_build():
+            shutil.rmtree(os.path.join(root, "docs"), ignore_errors=True)
+            cwd = os.getcwd()
+            os.chdir(root)
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    build_main(["--jobs", str(jobs), "--no-cache"])
+            finally:
+                os.chdir(cwd)
+
+        record("build", full_build, 1)
+
+    return {
+        "project": project_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "params": {
+            "pages": pages + 1,
+            "blocks_per_page": blocks,
+            "mix": mix,
+            "spans": list(spans),
+            "repeat": repeat,
+            "jobs": jobs,
+            "markdown_bytes": sum(len(markdown) for markdown in markdowns),
+        },
+        "results": results,
+    }
+
+
+def compare_reports(baseline, current, threshold):
+    regressions = []
+    for stage, result in current["results"].items():
+        if stage not in baseline["results"]:
+            continue
+        before = baseline["results"][stage]["seconds"]
+        ratio = result["seconds"] / before if before else 1.0
+        print(
+            f"{stage:>22} {before * 1000:>10.1f} ms -> {result['seconds'] * 1000:>10.1f} ms"
+            f"  {ratio:>5.2f}x"
+        )
+        if ratio > 1 + threshold:
+            regressions.append(stage)
+    return regressions
+
+
+def project_version():
+    with open(os.path.join(ROOT_DIR, "pyproject.toml"), "rb") as f:
+        project = tomllib.load(f)["project"]
+    return f"{project['name']} {project['version']}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the markdown pipeline")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    inline = subparsers.add_parser(
+        "inline", help="legacy vs single-pass inline tokenizer"
+    )
+    inline.add_argument(
+        "--spans", type=int, nargs="+", default=[100, 1000, 5000, 10000]
+    )
+    inline.add_argument("--repeat", type=int, default=5)
+
+    classify = subparsers.add_parser(
+        "classify", help="if/elif vs table-driven block classifier"
+    )
+    classify.add_argument("--blocks", type=int, default=2000000)
+    classify.add_argument("--repeat", type=int, default=3)
+
+    render = subparsers.add_parser("render", help="to_html on one large document")
+    render.add_argument("--blocks", type=int, default=50000)
+    render.add_argument("--repeat", type=int, default=3)
+
+    memory = subparsers.add_parser(
+        "memory", help="peak RSS while building one large document tree"
+    )
+    memory.add_argument("--blocks", type=int, default=50000)
+
+    suite = subparsers.add_parser(
+        "suite", help="time each pipeline stage and a full build, as JSON"
+    )
+    suite.add_argument("--pages", type=int, default=200)
+    suite.add_argument("--blocks", type=int, default=50, help="blocks per page")
+    suite.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=DEFAULT_MIX,
+        help="block weights, e.g. paragraph=4,heading=1,code=1",
+    )
+    suite.add_argument(
+        "--spans", type=int, nargs=2, default=[5, 20], help="inline spans per paragraph"
+    )
+    suite.add_argument("--repeat", type=int, default=3)
+    suite.add_argument("--jobs", type=int, default=1)
+    suite.add_argument("--output", help="write the JSON results to this file")
+
+    compare = subparsers.add_parser(
+        "compare", help="compare two suite reports and fail on regressions"
+    )
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument(
+        "--threshold", type=float, default=0.1, help="allowed slowdown, 0.1 is 10%%"
+    )
+
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    if args.command == "inline":
+        bench_inline(args.spans, args.repeat)
+    elif args.command == "classify":
+        bench_classify(args.blocks, args.repeat)
+    elif args.command == "render":
+        bench_render(args.blocks, args.repeat)
+    elif args.command == "memory":
+        bench_memory(args.blocks)
+    elif args.command == "suite":
+        report = bench_suite(
+            args.pages, args.blocks, args.mix, args.spans, args.repeat, args.jobs
+        )
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+        else:
+            print(json.dumps(report, indent=2))
+    elif args.command == "compare":
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        with open(args.current, "r") as f:
+            current = json.load(f)
+        regressions = compare_reports(baseline, current, args.threshold)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import os
+from collections import OrderedDict
+
+
+# On-disk cache of rendered page bodies
+class RenderCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key, ext=".html"):
+        return os.path.join(self.directory, key[:2], key + ext)
+
+    def get(self, key, with_text=False):
+        # With with_text, returns (body, text); an entry stored without text misses
+        paths = [self.path(key)]
+        if with_text:
+            paths.append(self.path(key, ".txt"))
+        values = []
+        for path in paths:
+            try:
+                with open(path, "r") as f:
+                    values.append(f.read())
+            except FileNotFoundError:
+                self.misses += 1
+                return None
+
+        # The mtime doubles as the last-used time that trim evicts by
+        for path in paths:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        self.hits += 1
+        return tuple(values) if with_text else values[0]
+
+    def put(self, key, value, text=None):
+        # The page's text for the search index is stored next to its body
+        self.write(self.path(key), value)
+        if text is not None:
+            self.write(self.path(key, ".txt"), text)
+
+    def write(self, path, value):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write then rename, so a reader in another worker never sees half a file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(value)
+        os.replace(tmp_path, path)
+
+    def trim(self):
+        entries = []
+        for dir_path, _, file_names in os.walk(self.directory):
+            for name in file_names:
+                path = os.path.join(dir_path, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, path))
+
+        # Keep the most recently used entries that fit, evict the rest
+        entries.sort(reverse=True)
+        total = 0
+        for _, size, path in entries:
+            total += size
+            if total > self.max_bytes:
+                # Another build may have evicted it already
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+def entry_size(value):
+    # Block cache values are strings or tuples of them, like a block's HTML and text
+    if isinstance(value, str):
+        return len(value)
+    return sum(len(part) for part in value)
+
+
+# In-memory LRU cache of rendered block fragments
+class BlockCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        cost = len(key) + entry_size(value)
+        if cost > self.max_bytes:
+            return
+
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(key) + entry_size(previous)
+        self.entries[key] = value
+        self.size += cost
+
+        while self.size > self.max_bytes:
+            old_key, old_value = self.entries.popitem(last=False)
+            self.size -= len(old_key) + entry_size(old_value)
@@ -1,3 +1,6 @@
+import re
+import json
+import hashlib
 from enum import Enum
 
 
@@ -19,6 +22,8 @@ class BlockType(Enum):
 
 
 class TextNode:
+    __slots__ = ("text", "text_type", "url")
+
     def __init__(self, text, text_type, url=None):
         self.text = text
         self.text_type = text_type
@@ -39,6 +44,7 @@ class TextNode:
 
 
 class HTMLNode:
+    __slots__ = ("tag", "value", "children", "props")
 
     def __init__(self, tag=None, value=None, children=None, props=None):
         self.tag = tag
@@ -47,16 +53,19 @@ class HTMLNode:
         self.props = props
 
     def to_html(self):
+        out = []
+        self.render_into(out.append)
+        return "".join(out)
+
+    # write is any callable taking a string: list.append, a file's write, ...
+    def render_into(self, write):
         raise NotImplementedError("Error: to_html method not implemented")
 
     def props_to_html(self):
-        end_string = str()
         if self.props is None:
-            return end_string
+            return str()
 
-        for k, v in self.props.items():
-            end_string += f' {k}="{v}"'
-        return end_string
+        return "".join([f' {k}="{v}"' for k, v in self.props.items()])
 
     def __repr__(self):
         return f"HTMLNode({self.tag}, {self.value}, {self.children}, {self.props})"
@@ -74,39 +83,116 @@ class HTMLNode:
 
 
 class LeafNode(HTMLNode):
+    __slots__ = ()
+
     def __init__(self, tag=None, value=None, props=None):
         super().__init__(tag, value, None, props)
 
-    def to_html(self):
+    def render_into(self, write):
         if self.value is None:
             raise ValueError("Error: No value provided for LeafNode.")
         elif self.tag is None:
-            return self.value
+            write(self.value)
         elif self.tag == "img":
-            return f"<{self.tag}{self.props_to_html()}>"
+            write(f"<{self.tag}{self.props_to_html()}>")
         else:
-            return f"<{self.tag}{self.props_to_html()}>{self.value}</{self.tag}>"
+            write(f"<{self.tag}{self.props_to_html()}>{self.value}</{self.tag}>")
 
     def __repr__(self):
         return f"LeafNode({self.tag}, {self.value}, {self.props})"
 
 
 class ParentNode(HTMLNode):
+    __slots__ = ()
+
     def __init__(self, tag=None, children=None, props=None):
         super().__init__(tag, None, children, props)
 
-    def to_html(self):
+    def render_into(self, write):
         if self.tag is None:
             raise ValueError("Error: No tag provided for ParentNode.")
         elif self.children is None or len(self.children) == 0:
             raise ValueError("Error: No children provided for ParentNode.")
         else:
-            end_string = f"<{self.tag}{self.props_to_html()}>"
+            write(f"<{self.tag}{self.props_to_html()}>")
             for child in self.children:
-                child_string = child.to_html()
-                end_string += child_string
-            end_string += f"</{self.tag}>"
-            return end_string
+                child.render_into(write)
+            write(f"</{self.tag}>")
 
     def __repr__(self):
         return f"HTMLNode({self.tag}, {self.children}, {self.props})"
+
+
+class AssetManifest:
+    def __init__(self, urls, sizes=None):
+        # Site URL of each static file -> site URL of its fingerprinted copy
+        self.urls = urls
+        # Site URL of each image -> [width, height]
+        self.sizes = sizes if sizes is not None else {}
+        self.digest = hashlib.sha256(
+            json.dumps([urls, self.sizes], sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, url, default=None):
+        return self.urls.get(url, default)
+
+    def size(self, url):
+        return self.sizes.get(url)
+
+    def __eq__(self, other):
+        return self.urls == other.urls and self.sizes == other.sizes
+
+    def __repr__(self):
+        return f"AssetManifest({self.urls}, {self.sizes})"
+
+
+class Template:
+    placeholder_pattern = re.compile(r"\{\{ (\w+) \}\}")
+    asset_pattern = re.compile(r'\b(href|src)="(/[^"]*)"')
+
+    def __init__(self, text, basepath="/", assets=None):
+        self.parts = []
+        self.slots = []
+
+        position = 0
+        for match in self.placeholder_pattern.finditer(text):
+            self.parts.append(
+                self.rewrite_paths(text[position : match.start()], basepath, assets)
+            )
+            self.slots.append((len(self.parts), match.group(1)))
+            # Unfilled placeholders render as they were written
+            self.parts.append(match.group(0))
+            position = match.end()
+        self.parts.append(self.rewrite_paths(text[position:], basepath, assets))
+
+    @staticmethod
+    def rewrite_paths(text, basepath, assets=None):
+        if assets is not None:
+            text = Template.asset_pattern.sub(
+                lambda match: f'{match[1]}="{assets.get(match[2], match[2])}"', text
+            )
+        text = text.replace('href="/', f'href="{basepath}')
+        return text.replace('src="/', f'src="{basepath}')
+
+    def render(self, values):
+        out = []
+        self.render_into(out.append, values)
+        return "".join(out)
+
+    def render_into(self, write, values):
+        # A value is a string or, like HTMLNode.render_into, a callable taking write
+        parts = self.parts.copy()
+        for index, name in self.slots:
+            if name in values:
+                parts[index] = values[name]
+        for part in parts:
+            if callable(part):
+                part(write)
+            else:
+                write(part)
+
+    def __eq__(self, other):
+        return self.parts == other.parts and self.slots == other.slots
+
+    def __repr__(self):
+        return f"Template({self.parts}, {self.slots})"
@@ -0,0 +1,113 @@
+import os
+import gzip
+import json
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functions import sync_file, remove_output
+from log import log_event
+
+COMPRESSIBLE_EXTENSIONS = frozenset(
+    {".html", ".css", ".js", ".mjs", ".json", ".svg", ".xml", ".txt", ".map"}
+)
+# Below this many bytes a sidecar saves less than the extra request costs
+MIN_COMPRESS_SIZE = 1024
+SIDECARS_FILE = "sidecars.json"
+
+
+def compressible_files(root, min_size):
+    files = []
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names.sort()
+        for name in sorted(file_names):
+            if os.path.splitext(name)[1] not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            path = os.path.join(dir_path, name)
+            if os.path.getsize(path) >= min_size:
+                files.append(path)
+    return files
+
+
+def compress_file(path, cache_dir):
+    with open(path, "rb") as f:
+        data = f.read()
+
+    # Compressed outputs are stored by content hash, so unchanged files reuse them
+    key = hashlib.sha256(data).hexdigest()
+    cached_path = os.path.join(cache_dir, key[:2], key + ".gz")
+    reused = os.path.exists(cached_path)
+    if not reused:
+        os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+        tmp_path = f"{cached_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            # mtime=0 keeps the output identical from one build to the next
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+        os.replace(tmp_path, cached_path)
+
+    sync_file(cached_path, path + ".gz")
+    return cached_path, reused, len(data), os.path.getsize(cached_path)
+
+
+def load_sidecars(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, SIDECARS_FILE), "r") as f:
+            return set(json.load(f))
+    except (OSError, ValueError):
+        return set()
+
+
+def save_sidecars(cache_dir, sidecars):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, SIDECARS_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(sorted(sidecars), f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def remove_sidecars(dest_dir_path, cache_dir):
+    # A build without compression would leave the sidecars serving old pages
+    sidecars = load_sidecars(cache_dir)
+    for path in sorted(sidecars):
+        remove_output(path, dest_dir_path)
+    if sidecars:
+        save_sidecars(cache_dir, set())
+    return sidecars
+
+
+def prune_cache(cache_dir, used):
+    for dir_path, _, file_names in os.walk(cache_dir):
+        for name in file_names:
+            path = os.path.join(dir_path, name)
+            if name.endswith(".gz") and path not in used:
+                os.remove(path)
+
+
+def compress_outputs(dest_dir_path, cache_dir, min_size=MIN_COMPRESS_SIZE, workers=1):
+    files = compressible_files(dest_dir_path, min_size)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(executor.map(compress_file, files, [cache_dir] * len(files)))
+
+    # Only sidecars this stage wrote are removed, never a .gz file from static/
+    sidecars = {os.path.normpath(path + ".gz") for path in files}
+    for path in sorted(load_sidecars(cache_dir) - sidecars):
+        remove_output(path, dest_dir_path)
+    save_sidecars(cache_dir, sidecars)
+
+    # Keep only what this build used, so the cache stays the size of the site
+    prune_cache(cache_dir, {cached_path for cached_path, _, _, _ in results})
+
+    reused = sum(1 for _, was_reused, _, _ in results if was_reused)
+    original = sum(size for _, _, size, _ in results)
+    compressed = sum(size for _, _, _, size in results)
+    log_event(
+        logging.INFO,
+        "compress",
+        f"Compressed {len(files)} files ({reused} reused),"
+        f" {original / 1e6:.1f} MB -> {compressed / 1e6:.1f} MB",
+        files=len(files),
+        reused=reused,
+        bytes=original,
+        compressed_bytes=compressed,
+    )
+    return results
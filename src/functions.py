@@ -1,11 +1,38 @@
 import re
 import os
+import asyncio
+import json
+import time
+import logging
 import shutil
-from classes import TextNode, TextType, LeafNode, BlockType, ParentNode
+import hashlib
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from classes import (
+    TextNode,
+    TextType,
+    LeafNode,
+    BlockType,
+    ParentNode,
+    Template,
+    AssetManifest,
+)
+from profiling import StageTimer
+from log import log_event, Progress
+from graph import DependencyGraph
+from minify import HTMLMinifier, MinifyReport, minify_html
 
 
 # Text node to HTML conversion
-def text_node_to_html(text_node):
+def rewrite_url(url, basepath, assets=None):
+    if assets is not None:
+        url = assets.get(url, url)
+    if basepath != "/" and url.startswith("/"):
+        return basepath + url[1:]
+    return url
+
+
+def text_node_to_html(text_node, basepath="/", assets=None):
     match text_node.text_type:
         case TextType.TEXT:
             return LeafNode(value=text_node.text)
@@ -16,20 +43,41 @@ def text_node_to_html(text_node):
         case TextType.CODE:
             return LeafNode("code", text_node.text)
         case TextType.LINK:
-            return LeafNode("a", text_node.text, {"href": text_node.url})
+            return LeafNode(
+                "a",
+                text_node.text,
+                {"href": rewrite_url(text_node.url, basepath, assets)},
+            )
         case TextType.IMAGE:
-            return LeafNode("img", "", {"src": text_node.url, "alt": text_node.text})
+            props = {
+                "src": rewrite_url(text_node.url, basepath, assets),
+                "alt": text_node.text,
+            }
+            # Known dimensions let the browser reserve the space before loading
+            size = None if assets is None else assets.size(text_node.url)
+            if size is not None:
+                props["width"] = str(size[0])
+                props["height"] = str(size[1])
+                props["loading"] = "lazy"
+            return LeafNode("img", "", props)
         case _:
             raise Exception("TextNode type not supported: " + str(text_node.text_type))
 
 
 # Regex functions
+# Neither part may hold its own brackets or a newline, so a failed match stops at
+# the next "[" or "(" instead of scanning on to the end of the text
+LINK_PATTERN = r"\[([^\[\]\n]*)\]\(([^()\n]*)\)"
+MARKDOWN_IMAGE = re.compile(r"\!" + LINK_PATTERN)
+MARKDOWN_LINK = re.compile(r"(?<!\!)" + LINK_PATTERN)
+
+
 def extract_markdown_images(text):
-    return re.findall(r"\!\[(.*?)\]\((.*?)\)", text)
+    return MARKDOWN_IMAGE.findall(text)
 
 
 def extract_markdown_links(text):
-    return re.findall(r"(?<!\!)\[(.*?)\]\((.*?)\)", text)
+    return MARKDOWN_LINK.findall(text)
 
 
 # Split nodes functions
@@ -120,6 +168,10 @@ def split_nodes_image(old_nodes):
     new_nodes = []  # [node]
 
     for node in old_nodes:  # text, TextType
+        if node.text_type is not TextType.TEXT:
+            new_nodes.append(node)
+            continue
+
         images = extract_markdown_images(node.text)
 
         if len(images) == 0:
@@ -146,6 +198,10 @@ def split_nodes_link(old_nodes):
     new_nodes = []  # [node]
 
     for node in old_nodes:  # text, TextType
+        if node.text_type is not TextType.TEXT:
+            new_nodes.append(node)
+            continue
+
         links = extract_markdown_links(node.text)
 
         if len(links) == 0:
@@ -168,7 +224,40 @@ def split_nodes_link(old_nodes):
 
 
 # Text to text nodes conversion
-def text_to_textnodes(text):
+# Set SSG_LEGACY_INLINE=1 to build with the chained split_nodes_* pipeline instead
+LEGACY_INLINE = os.environ.get("SSG_LEGACY_INLINE") == "1"
+
+INLINE_MARKUP = re.compile(r"[`*_!\[]")
+# The scanner checks for a "!" in front of a link itself
+INLINE_LINK = re.compile(LINK_PATTERN)
+INLINE_DELIMITER = re.compile(r"`|\*\*|_")
+
+# The legacy pipeline splits code, then bold, then italic, then images, then links
+INLINE_PASS = {
+    TextType.CODE: 0,
+    TextType.BOLD: 1,
+    TextType.ITALIC: 2,
+    TextType.IMAGE: 3,
+    TextType.LINK: 4,
+}
+
+
+def has_inline_markup(text):
+    # Five substring scans beat one character-class regex search on plain prose
+    return "`" in text or "*" in text or "_" in text or "[" in text or "!" in text
+
+
+def text_to_textnodes(text, legacy=None):
+    if not has_inline_markup(text):
+        return [TextNode(text, TextType.TEXT)]
+    if legacy is None:
+        legacy = LEGACY_INLINE
+    if legacy:
+        return text_to_textnodes_legacy(text)
+    return scan_text_nodes(text)
+
+
+def text_to_textnodes_legacy(text):
     initial_node = TextNode(text, TextType.TEXT)
 
     code_separated = split_nodes_delimiter([initial_node], "`", TextType.CODE)
@@ -184,209 +273,1348 @@ def text_to_textnodes(text):
     return link_separated
 
 
+def scan_closing_delimiter(text, delimiter, start):
+    end = text.find(delimiter, start + len(delimiter))
+    if end == -1:
+        raise ValueError(f"Error: Unclosed '{delimiter}' delimiter in: {text}")
+    return end
+
+
+def scan_text_nodes(text):
+    nodes = []
+    gap_start = 0
+    previous_pass = None
+
+    match = INLINE_MARKUP.search(text)
+    while match:
+        position = match.start()
+        char = text[position]
+        node = None
+
+        if char == "`" or char == "_":
+            end = scan_closing_delimiter(text, char, position)
+            text_type = TextType.CODE if char == "`" else TextType.ITALIC
+            node = TextNode(text[position + 1 : end], text_type)
+            next_position = end + 1
+        elif char == "*" and text.startswith("**", position):
+            end = scan_closing_delimiter(text, "**", position)
+            node = TextNode(text[position + 2 : end], TextType.BOLD)
+            next_position = end + 2
+        elif char == "!":
+            image = MARKDOWN_IMAGE.match(text, position)
+            # Delimiters are split out before images, so they cannot sit inside one
+            if image and not INLINE_DELIMITER.search(text, position, image.end()):
+                node = TextNode(image.group(1), TextType.IMAGE, url=image.group(2))
+                next_position = image.end()
+        elif char == "[" and not (position > gap_start and text[position - 1] == "!"):
+            link = INLINE_LINK.match(text, position)
+            # Likewise for links, which are split out after images as well
+            if (
+                link
+                and not INLINE_DELIMITER.search(text, position, link.end())
+                and not MARKDOWN_IMAGE.search(text, position, link.end())
+            ):
+                node = TextNode(link.group(1), TextType.LINK, url=link.group(2))
+                next_position = link.end()
+
+        if node is None:
+            match = INLINE_MARKUP.search(text, position + 1)
+            continue
+
+        # The legacy pipeline keeps an empty text node in front of a span unless
+        # that span was split out by an earlier pass than the one before it
+        gap = text[gap_start:position]
+        current_pass = INLINE_PASS[node.text_type]
+        if gap or previous_pass is None or previous_pass <= current_pass:
+            nodes.append(TextNode(gap, TextType.TEXT))
+        nodes.append(node)
+
+        previous_pass = current_pass
+        gap_start = next_position
+        match = INLINE_MARKUP.search(text, next_position)
+
+    if not nodes:
+        return [TextNode(text, TextType.TEXT)]
+    if gap_start < len(text):
+        nodes.append(TextNode(text[gap_start:], TextType.TEXT))
+    return nodes
+
+
 # Markdown to blocks function
 def markdown_to_blocks(markdown):
-    blocks = list(
-        filter(lambda x: x != "", map(lambda x: x.strip(), markdown.split("\n\n")))
-    )
+    blocks = list(iter_markdown_blocks(markdown.split("\n")))
 
     return blocks
 
 
-def block_to_blocktype(block):
-    if block.startswith("# ") and "\n" not in block:
-        return BlockType.HEADING
-    elif block.startswith("## ") and "\n" not in block:
-        return BlockType.HEADING
-    elif block.startswith("### ") and "\n" not in block:
-        return BlockType.HEADING
-    elif block.startswith("#### ") and "\n" not in block:
-        return BlockType.HEADING
-    elif block.startswith("##### ") and "\n" not in block:
-        return BlockType.HEADING
-    elif block.startswith("###### ") and "\n" not in block:
+def iter_markdown_blocks(lines):
+    for _, block in iter_block_spans(lines):
+        yield block
+
+
+def iter_block_spans(lines):
+    # Yields (first line number, block) as soon as the blank line that ends it is read
+    block_lines = []
+    start = 0
+    fenced = False
+    for number, line in enumerate(lines, 1):
+        # Handles \n, \r\n and lines read from a file alike
+        line = line.rstrip("\r\n")
+
+        if line.startswith("```"):
+            # A fence that also closes on its own line does not open a code block
+            fenced = not fenced and not (len(line) >= 6 and line.endswith("```"))
+
+        # Blank lines inside a fenced code block belong to the block
+        if fenced or (line and not line.isspace()):
+            if not block_lines:
+                start = number
+            block_lines.append(line)
+            continue
+
+        block = "\n".join(block_lines).strip()
+        block_lines = []
+        if block:
+            yield start, block
+
+    block = "\n".join(block_lines).strip()
+    if block:
+        yield start, block
+
+
+# Block classification: the first character picks the only rule that can match
+HEADING_PREFIX = re.compile(r"#{1,6} ")
+
+
+def classify_heading(block):
+    if HEADING_PREFIX.match(block) and "\n" not in block:
         return BlockType.HEADING
+    return BlockType.PARAGRAPH
 
-    elif block.startswith("```") and block.endswith("```"):
+
+def classify_code(block):
+    if block.startswith("```") and block.endswith("```"):
         return BlockType.CODE
+    return BlockType.PARAGRAPH
 
-    elif block.startswith("> "):
-        lines = block.split("\n")
-        if all(line.startswith(">") for line in lines):
-            return BlockType.QUOTE
-
-    elif block.startswith("- "):
-        lines = block.split("\n")
-        if all(map(lambda x: x.startswith("- "), lines)):
-            return BlockType.UNORDERED_LIST
-
-    elif block[0] == "1" and block[1] == ".":
-        lines = block.split("\n")
-        if all(map(lambda x: x[0].isdigit() and x[1] == ".", lines)):
-            nums = []
-            for line in lines:
-                nums.append(int(line.split(".")[0]))
-            if nums == list(range(1, len(nums) + 1)):
-                return BlockType.ORDERED_LIST
 
-    else:
+def classify_quote(block):
+    # Every line starts with ">" exactly when every newline is followed by one
+    if block.startswith("> ") and block.count("\n") == block.count("\n>"):
+        return BlockType.QUOTE
+    return BlockType.PARAGRAPH
+
+
+def classify_unordered_list(block):
+    if block.startswith("- ") and block.count("\n") == block.count("\n- "):
+        return BlockType.UNORDERED_LIST
+    return BlockType.PARAGRAPH
+
+
+def classify_ordered_list(block):
+    # Items must be numbered 1., 2., 3., ... in order
+    position = 0
+    number = 1
+    while True:
+        marker = f"{number}."
+        if not block.startswith(marker, position):
+            return BlockType.PARAGRAPH
+        position = block.find("\n", position + len(marker))
+        if position == -1:
+            return BlockType.ORDERED_LIST
+        position += 1
+        number += 1
+
+
+BLOCK_CLASSIFIERS = {
+    "#": classify_heading,
+    "`": classify_code,
+    ">": classify_quote,
+    "-": classify_unordered_list,
+    "1": classify_ordered_list,
+}
+
+
+def block_to_blocktype(block):
+    # Blocks that fail their rule are paragraphs, so this always returns a type
+    classify = BLOCK_CLASSIFIERS.get(block[:1])
+    if classify is None:
         return BlockType.PARAGRAPH
+    return classify(block)
 
 
-def text_to_children(text):
+def text_to_children(text, basepath="/", assets=None, texts=None):
     text_nodes = text_to_textnodes(text)
+    # What a reader sees, for the search index: the node texts without markup
+    if texts is not None:
+        texts.append("".join(node.text for node in text_nodes))
 
     html_nodes = []
     for node in text_nodes:
-        html_nodes.append(text_node_to_html(node))
+        html_nodes.append(text_node_to_html(node, basepath, assets))
 
     return html_nodes
 
 
-def markdown_to_html_node(markdown):
-    final_nodes = []
+def block_to_html_node(
+    block, basepath="/", block_type=None, to_children=None, assets=None, texts=None
+):
+    # The profiler passes both in so it can time classification and inline apart
+    if block_type is None:
+        block_type = block_to_blocktype(block)
+    if to_children is None:
+        to_children = text_to_children
 
-    blocks = markdown_to_blocks(markdown)
+    match block_type:
+        case BlockType.PARAGRAPH:
+            lines = block.split("\n")
+            text = " ".join(line.strip() for line in lines)
 
-    for block in blocks:
-        block_type = block_to_blocktype(block)
+            children_nodes = to_children(text, basepath, assets, texts)
 
-        match block_type:
-            case BlockType.PARAGRAPH:
-                lines = block.split("\n")
-                text = " ".join(line.strip() for line in lines)
+            return ParentNode(tag="p", children=children_nodes)
 
-                children_nodes = text_to_children(text)
+        case BlockType.HEADING:
+            text = block.lstrip("#").strip()
 
-                final_nodes.append(ParentNode(tag="p", children=children_nodes))
+            children_nodes = to_children(text, basepath, assets, texts)
 
-            case BlockType.HEADING:
-                text = block.lstrip("#").strip()
+            header_level = f"h{block.count('#')}"
 
-                children_nodes = text_to_children(text)
+            return ParentNode(tag=f"{header_level}", children=children_nodes)
 
-                header_level = f"h{block.count('#')}"
+        case BlockType.CODE:
+            text_node = TextNode(block.strip("`\n "), TextType.CODE)
 
-                final_nodes.append(
-                    ParentNode(tag=f"{header_level}", children=children_nodes)
-                )
+            html_node = text_node_to_html(text_node)
+            if texts is not None:
+                texts.append(text_node.text)
 
-            case BlockType.CODE:
-                text_node = TextNode(block.strip("`\n "), TextType.CODE)
+            if "\n" not in html_node.value:
+                return html_node
+            else:
+                html_node.value += "\n"
+                return ParentNode(tag="pre", children=[html_node])
 
-                html_node = text_node_to_html(text_node)
+        case BlockType.QUOTE:
+            lines = block.split("\n")
+            text = " ".join(line.lstrip("> ") for line in lines)
+            children_nodes = to_children(text, basepath, assets, texts)
 
-                if "\n" not in html_node.value:
-                    final_nodes.append(html_node)
-                else:
-                    html_node.value += "\n"
-                    final_nodes.append(ParentNode(tag="pre", children=[html_node]))
+            return ParentNode(tag="blockquote", children=children_nodes)
 
-            case BlockType.QUOTE:
-                lines = block.split("\n")
-                text = " ".join(line.lstrip("> ") for line in lines)
-                children_nodes = text_to_children(text)
+        case BlockType.UNORDERED_LIST:
+            items = block.split("\n")
 
-                final_nodes.append(
-                    ParentNode(tag="blockquote", children=children_nodes)
-                )
+            list_items = []
 
-            case BlockType.UNORDERED_LIST:
-                items = block.split("\n")
+            for item in items:
+                children_nodes = to_children(item.strip("- "), basepath, assets, texts)
 
-                list_items = []
+                list_items.append(ParentNode(tag="li", children=children_nodes))
 
-                for item in items:
-                    children_nodes = text_to_children(item.strip("- "))
+            return ParentNode(tag="ul", children=list_items)
 
-                    list_items.append(ParentNode(tag="li", children=children_nodes))
+        case BlockType.ORDERED_LIST:
+            items = block.split("\n")
 
-                final_nodes.append(ParentNode(tag="ul", children=list_items))
+            list_items = []
 
-            case BlockType.ORDERED_LIST:
-                items = block.split("\n")
+            for item in items:
+                children_nodes = to_children(
+                    item.strip("1234567890. "), basepath, assets, texts
+                )
 
-                list_items = []
+                list_items.append(ParentNode(tag="li", children=children_nodes))
 
-                for item in items:
-                    children_nodes = text_to_children(item.strip("1234567890. "))
+            return ParentNode(tag="ol", children=list_items)
 
-                    list_items.append(ParentNode(tag="li", children=children_nodes))
 
-                final_nodes.append(ParentNode(tag="ol", children=list_items))
+def cached_block_to_html_node(block, basepath, block_cache, assets=None):
+    # Cached blocks come back as raw HTML in a tagless leaf, with their text
+    if assets is None:
+        key = f"{basepath}\0{block}"
+    else:
+        key = f"{basepath}\0{assets.digest}\0{block}"
+    cached = block_cache.get(key)
+    if cached is None:
+        texts = []
+        html = block_to_html_node(block, basepath, assets=assets, texts=texts).to_html()
+        cached = (html, " ".join(texts))
+        block_cache.put(key, cached)
+    html, text = cached
+    return LeafNode(value=html), text
+
+
+def iter_html_nodes(
+    spans, basepath="/", block_cache=None, assets=None, collect_text=None
+):
+    # collect_text, if given, is called with each block's text as it is rendered
+    for line, block in spans:
+        try:
+            if block_cache is None:
+                texts = None if collect_text is None else []
+                html_node = block_to_html_node(
+                    block, basepath, assets=assets, texts=texts
+                )
+                text = None if texts is None else " ".join(texts)
+            else:
+                html_node, text = cached_block_to_html_node(
+                    block, basepath, block_cache, assets
+                )
+        except ValueError as e:
+            raise ValueError(f"{e} (in the block starting at line {line})") from e
+        if collect_text is not None:
+            collect_text(text)
+        yield html_node
+
+
+def markdown_to_html_node(
+    markdown, basepath="/", block_cache=None, assets=None, collect_text=None
+):
+    spans = iter_block_spans(markdown.split("\n"))
+    final_nodes = list(
+        iter_html_nodes(spans, basepath, block_cache, assets, collect_text)
+    )
 
     master_html = ParentNode(tag="div", children=final_nodes)
 
     return master_html
 
 
-def copy_directory_contents(src, dest):
-    if os.path.exists(dest):
-        shutil.rmtree(dest)
-    os.mkdir(dest)
+def render_blocks_into(
+    spans, write, basepath="/", block_cache=None, assets=None, collect_text=None
+):
+    # Streaming counterpart of markdown_to_html_node(...).render_into(write),
+    # taking the (line number, block) pairs of iter_block_spans
+    empty = True
+    write("<div>")
+    for html_node in iter_html_nodes(
+        spans, basepath, block_cache, assets, collect_text
+    ):
+        html_node.render_into(write)
+        empty = False
+    if empty:
+        raise ValueError("Error: No children provided for ParentNode.")
+    write("</div>")
+
+
+def copy_directory_contents(src, dest, keep=frozenset()):
+    # Syncs src into dest: unchanged files are skipped and files that are in
+    # neither src nor keep are deleted
+    os.makedirs(dest, exist_ok=True)
+
+    src_items = os.listdir(src)
+    for item in sorted(src_items):
+        src_path = os.path.join(src, item)
+        dest_path = os.path.join(dest, item)
+        if os.path.isfile(src_path):
+            if os.path.isdir(dest_path):
+                shutil.rmtree(dest_path)
+            if sync_file(src_path, dest_path):
+                log_copied(src_path, dest)
+        elif os.path.isdir(src_path):
+            if os.path.isfile(dest_path):
+                os.remove(dest_path)
+            copy_directory_contents(src_path, dest_path, keep)
+
+    for item in sorted(set(os.listdir(dest)) - set(src_items)):
+        remove_orphans(os.path.join(dest, item), keep)
+
+
+def log_copied(src_path, dest):
+    log_event(
+        logging.DEBUG,
+        "copy",
+        f"Copied file: {src_path} to {dest}",
+        src=src_path,
+        dest=dest,
+    )
+
+
+def log_removed(path):
+    log_event(logging.DEBUG, "remove", f"Removed stale output: {path}", path=path)
 
-    for item in os.listdir(src):
-        if os.path.isfile(os.path.join(src, item)):
-            shutil.copy2(os.path.join(src, item), dest)
-            print(f"Copied file: {os.path.join(src, item)} to {dest}")
-        elif os.path.isdir(os.path.join(src, item)):
-            os.makedirs(os.path.join(dest, item))
-            copy_directory_contents(os.path.join(src, item), os.path.join(dest, item))
+
+def sync_file(src_path, dest_path):
+    src_stat = os.stat(src_path)
+    try:
+        dest_stat = os.stat(dest_path)
+    except FileNotFoundError:
+        dest_stat = None
+
+    if dest_stat is not None:
+        if os.path.samestat(src_stat, dest_stat) or (
+            src_stat.st_size == dest_stat.st_size
+            and src_stat.st_mtime_ns == dest_stat.st_mtime_ns
+        ):
+            return False
+        os.remove(dest_path)
+
+    # A hardlink costs no bytes; other filesystems or link limits fall back to a copy
+    try:
+        os.link(src_path, dest_path)
+    except OSError:
+        shutil.copy2(src_path, dest_path)
+    return True
+
+
+@contextmanager
+def open_output(dest_path, encoding=None):
+    # Static files are hardlinked into the output, so writing in place could
+    # change the source; a new file is written and renamed over the old one
+    tmp_path = dest_path + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding=encoding) as f:
+            yield f
+        os.replace(tmp_path, dest_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def remove_orphans(path, keep):
+    if os.path.isdir(path) and not os.path.islink(path):
+        for item in sorted(os.listdir(path)):
+            remove_orphans(os.path.join(path, item), keep)
+        if not os.listdir(path):
+            os.rmdir(path)
+    elif os.path.normpath(path) not in keep:
+        os.remove(path)
+        log_removed(path)
+
+
+# Asset fingerprinting: each static file is also published under a name
+# containing its content hash, which pages link to instead
+ASSET_MANIFEST = "assets.json"
+FINGERPRINT_LENGTH = 10
+
+
+def fingerprinted_path(rel_path, digest):
+    root, ext = os.path.splitext(rel_path)
+    return f"{root}.{digest[:FINGERPRINT_LENGTH]}{ext}"
+
+
+def site_url(rel_path):
+    return "/" + rel_path.replace(os.sep, "/")
+
+
+def site_path(dest_dir_path, url):
+    return os.path.join(dest_dir_path, *url[1:].split("/"))
+
+
+def static_hashes(dir_path_static):
+    return {
+        rel_path: hash_file(os.path.join(dir_path_static, rel_path))
+        for rel_path in list_files(dir_path_static)
+    }
+
+
+def asset_manifest(hashes, sizes=None):
+    # hashes maps each static file's path relative to static/ to its sha256
+    return AssetManifest(
+        {
+            site_url(rel_path): site_url(fingerprinted_path(rel_path, digest))
+            for rel_path, digest in sorted(hashes.items())
+        },
+        sizes,
+    )
+
+
+def asset_outputs(dest_dir_path, assets):
+    outputs = {os.path.join(dest_dir_path, ASSET_MANIFEST)}
+    outputs.update(site_path(dest_dir_path, url) for url in assets.urls.values())
+    return {os.path.normpath(path) for path in outputs}
+
+
+def publish_assets(dir_path_static, dest_dir_path, assets):
+    # With assets None, everything a previous build published is removed
+    manifest_path = os.path.join(dest_dir_path, ASSET_MANIFEST)
+    published = set(load_manifest(manifest_path).values())
+    urls = {} if assets is None else assets.urls
+
+    for url, fingerprinted_url in urls.items():
+        src_path = site_path(dir_path_static, url)
+        dest_path = site_path(dest_dir_path, fingerprinted_url)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        if sync_file(src_path, dest_path):
+            log_copied(src_path, os.path.dirname(dest_path))
+
+    for url in sorted(published - set(urls.values())):
+        remove_output(site_path(dest_dir_path, url), dest_dir_path)
+
+    if assets is not None:
+        save_manifest(manifest_path, urls)
+    elif os.path.exists(manifest_path):
+        remove_output(manifest_path, dest_dir_path)
 
 
 def extract_title(markdown):
-    lines = markdown.split("\n")
+    return extract_title_from_lines(markdown.split("\n"))
+
+
+def extract_title_from_lines(lines):
     for line in lines:
         if line.startswith("# "):
             return line[2:].strip()
     raise Exception("No title found in markdown")
 
 
-def generate_page(from_path, template_path, dest_path, basepath):
-    print(
-        f"Generating page from {from_path} to {dest_path} using template {template_path}"
+def load_template(template_path, basepath, assets=None):
+    with open(template_path, "r") as f:
+        return Template(f.read(), basepath, assets)
+
+
+# Pages at least this large are streamed block by block instead of read whole
+STREAM_THRESHOLD = 1024 * 1024
+
+# Bump whenever a change to the markdown pipeline changes the rendered HTML
+PARSER_VERSION = "4"
+
+
+def render_cache_key(markdown, basepath, assets=None):
+    digest = hashlib.sha256()
+    parts = [PARSER_VERSION, str(LEGACY_INLINE), basepath, markdown]
+    if assets is not None:
+        parts.append(assets.digest)
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def page_content(
+    markdown_content,
+    basepath,
+    cache=None,
+    block_cache=None,
+    assets=None,
+    collect_text=None,
+):
+    # On a cache hit the markdown is never parsed; the page's text is cached
+    # next to its body for collect_text
+    with_text = collect_text is not None
+    if cache is not None:
+        cache_key = render_cache_key(markdown_content, basepath, assets)
+        cached = cache.get(cache_key, with_text)
+        if cached is not None and not with_text:
+            return cached
+        if cached is not None:
+            render_content, text = cached
+            collect_text(text)
+            return render_content
+
+    texts = [] if with_text else None
+    html_node = markdown_to_html_node(
+        markdown_content,
+        basepath,
+        block_cache,
+        assets,
+        texts.append if with_text else None,
     )
+    text = " ".join(texts) if with_text else None
+    if with_text:
+        collect_text(text)
+
+    if cache is None:
+        return html_node.render_into
+    render_content = html_node.to_html()
+    cache.put(cache_key, render_content, text)
+    return render_content
+
+
+def generate_page(
+    from_path,
+    template_path,
+    dest_path,
+    basepath,
+    quiet=False,
+    template=None,
+    stream=None,
+    cache=None,
+    block_cache=None,
+    timer=None,
+    index=None,
+    assets=None,
+    minify=None,
+):
+    if not quiet:
+        log_generating(from_path, dest_path, template_path)
+
+    if template is None:
+        template = load_template(template_path, basepath, assets)
+
+    # Profiled pages skip streaming and the caches, so every stage does its full work
+    if timer is not None:
+        generate_page_profiled(
+            from_path, dest_path, basepath, template, timer, index, assets, minify
+        )
+        return os.path.getsize(dest_path)
+
+    if stream is None:
+        stream = os.path.getsize(from_path) >= STREAM_THRESHOLD
+
+    if stream:
+        # The title is normally on the first line, so this read stops early
+        with open(from_path, "r") as f:
+            title = extract_title_from_lines(f)
+        terms = None if index is None else index.start_page(dest_path, title)
+
+        def render_content(write):
+            with open(from_path, "r") as f:
+                render_blocks_into(
+                    iter_block_spans(f),
+                    write,
+                    basepath,
+                    block_cache,
+                    assets,
+                    None if terms is None else terms.feed,
+                )
 
-    with open(from_path, "r") as f:
-        markdown_content = f.read()
+    else:
+        with open(from_path, "r") as f:
+            markdown_content = f.read()
+
+        title = extract_title(markdown_content)
+        terms = None if index is None else index.start_page(dest_path, title)
+        render_content = page_content(
+            markdown_content,
+            basepath,
+            cache,
+            block_cache,
+            assets,
+            None if terms is None else terms.feed,
+        )
 
-    with open(template_path, "r") as f:
-        template_content = f.read()
+    dest_dir = os.path.dirname(dest_path)
+    if not os.path.exists(dest_dir):
+        os.makedirs(dest_dir, exist_ok=True)
+
+    # The body is rendered straight into the file, never as one big string
+    with open_output(dest_path) as f:
+        write = f.write
+        if minify is not None:
+            minifier = HTMLMinifier(f.write)
+            write = minifier.feed
+        template.render_into(write, {"Title": title, "Content": render_content})
+        if minify is not None:
+            minifier.close()
+
+    written = os.path.getsize(dest_path)
+    if minify is not None:
+        minify.add(dest_path, minifier.size, written)
+    return written
+
+
+def log_generating(from_path, dest_path, template_path):
+    log_event(
+        logging.DEBUG,
+        "page",
+        f"Generating page from {from_path} to {dest_path} using template {template_path}",
+        src=from_path,
+        dest=dest_path,
+        template=template_path,
+    )
 
-    html_node = markdown_to_html_node(markdown_content)
-    html_string = html_node.to_html()
 
-    title = extract_title(markdown_content)
+def generate_page_profiled(
+    from_path,
+    dest_path,
+    basepath,
+    template,
+    timer,
+    index=None,
+    assets=None,
+    minify=None,
+):
+    def read_markdown():
+        with open(from_path, "r") as f:
+            return f.read()
 
-    template_content = template_content.replace("{{ Title }}", title)
-    template_content = template_content.replace("{{ Content }}", html_string)
+    def timed_children(text, basepath, assets, texts):
+        return timer.call("inline", text_to_children, text, basepath, assets, texts)
 
-    template_content = template_content.replace('href="/', f'href="{basepath}')
-    template_content = template_content.replace('src="/', f'src="{basepath}')
+    markdown_content = timer.call("read", read_markdown)
+    blocks = timer.call("block split", markdown_to_blocks, markdown_content)
+
+    final_nodes = []
+    texts = None if index is None else []
+    for block in blocks:
+        block_type = timer.call("classify", block_to_blocktype, block)
+        html_node = timer.call(
+            "tree build",
+            block_to_html_node,
+            block,
+            basepath,
+            block_type,
+            timed_children,
+            assets,
+            texts,
+        )
+        final_nodes.append(html_node)
+
+    html_node = ParentNode(tag="div", children=final_nodes)
+    content = timer.call("to_html", html_node.to_html)
+    title = timer.call("template", extract_title, markdown_content)
+    page = timer.call("template", template.render, {"Title": title, "Content": content})
+    if index is not None:
+        index.add_page(dest_path, title, " ".join(texts))
+
+    def write_page():
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        with open_output(dest_path) as f:
+            f.write(page if minify is None else minify_html(page))
+
+    timer.call("write", write_page)
+    if minify is not None:
+        minify.add(dest_path, len(page.encode("utf-8")), os.path.getsize(dest_path))
+
+
+# Set in each worker process so shared objects are shipped once, not once per page
+_worker_options = {}
+
+
+def _init_page_worker(options):
+    global _worker_options
+    _worker_options = options
+
+
+def cache_counts(cache, block_cache):
+    # Hits and misses of the page cache, then of the block cache
+    counts = []
+    for counted in (cache, block_cache):
+        counts += [0, 0] if counted is None else [counted.hits, counted.misses]
+    return counts
+
+
+def _generate_page_job(job):
+    from_path, template_path, dest_path, basepath, profile = job
+    timer = StageTimer() if profile else None
+    before = cache_counts(_worker_options["cache"], _worker_options["block_cache"])
+    written = generate_page(
+        from_path,
+        template_path,
+        dest_path,
+        basepath,
+        quiet=True,
+        timer=timer,
+        **_worker_options,
+    )
+    # Each worker has its own cache counts and index, so send back what this page added
+    after = cache_counts(_worker_options["cache"], _worker_options["block_cache"])
+    stages = timer.stages if profile else None
+    index = _worker_options["index"]
+    minify = _worker_options["minify"]
+    return (
+        from_path,
+        dest_path,
+        written,
+        [end - start for start, end in zip(before, after)],
+        stages,
+        None if index is None else index.take(),
+        None if minify is None else minify.take(),
+    )
 
-    dest_dir = os.path.dirname(dest_path)
-    if not os.path.exists(dest_dir):
-        os.makedirs(dest_dir)
 
-    with open(dest_path, "w") as f:
-        f.write(template_content)
+# Async page pipeline: reads run ahead of the renderer and writes run behind it
+def read_text(path):
+    with open(path, "r") as f:
+        return f.read()
+
+
+def write_text(path, text):
+    with open_output(path) as f:
+        f.write(text)
+    return os.path.getsize(path)
+
+
+async def generate_pages_async(
+    pages,
+    template_path,
+    basepath,
+    concurrency,
+    progress,
+    template,
+    cache=None,
+    block_cache=None,
+    index=None,
+    assets=None,
+    minify=None,
+):
+    # Every output directory is created once, before the first write is queued
+    for dest_dir in sorted({os.path.dirname(dest_path) for _, dest_path in pages}):
+        os.makedirs(dest_dir, exist_ok=True)
+
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(concurrency))
+
+    # A slot is held from the start of a page's read until its write has finished
+    slots = asyncio.Semaphore(concurrency)
+    queue = asyncio.Queue()
+    writes = set()
+
+    async def prefetch():
+        # The end marker goes out even on failure; awaiting prefetcher re-raises
+        try:
+            for from_path, dest_path in pages:
+                await slots.acquire()
+                if os.path.getsize(from_path) >= STREAM_THRESHOLD:
+                    read = None
+                else:
+                    read = asyncio.ensure_future(
+                        asyncio.to_thread(read_text, from_path)
+                    )
+                queue.put_nowait((from_path, dest_path, read))
+        finally:
+            queue.put_nowait(None)
+
+    async def write_page(dest_path, html):
+        size = len(html.encode("utf-8"))
+        try:
+            if minify is not None:
+                html = minify_html(html)
+            written = await asyncio.to_thread(write_text, dest_path, html)
+        finally:
+            slots.release()
+        if minify is not None:
+            minify.add(dest_path, size, written)
+        progress.update(written)
+
+    prefetcher = asyncio.ensure_future(prefetch())
+    try:
+        while (item := await queue.get()) is not None:
+            from_path, dest_path, read = item
+            log_generating(from_path, dest_path, template_path)
+
+            # Huge pages keep streaming into their file, off the event loop
+            if read is None:
+                try:
+                    written = await asyncio.to_thread(
+                        generate_page,
+                        from_path,
+                        template_path,
+                        dest_path,
+                        basepath,
+                        quiet=True,
+                        template=template,
+                        stream=True,
+                        block_cache=block_cache,
+                        index=index,
+                        assets=assets,
+                        minify=minify,
+                    )
+                finally:
+                    slots.release()
+                progress.update(written)
+                continue
+
+            markdown_content = await read
+            title = extract_title(markdown_content)
+            terms = None if index is None else index.start_page(dest_path, title)
+            content = page_content(
+                markdown_content,
+                basepath,
+                cache,
+                block_cache,
+                assets,
+                None if terms is None else terms.feed,
+            )
+            html = template.render({"Title": title, "Content": content})
+            write = asyncio.ensure_future(write_page(dest_path, html))
+            writes.add(write)
+            write.add_done_callback(writes.discard)
+
+        await prefetcher
+        await asyncio.gather(*writes)
+    finally:
+        prefetcher.cancel()
+
+
+def generate_pages(
+    pages,
+    template_path,
+    basepath,
+    jobs=1,
+    cache=None,
+    block_cache=None,
+    profile=None,
+    io_concurrency=0,
+    index=None,
+    assets=None,
+    minify=False,
+):
+    if not pages:
+        return
+
+    report = MinifyReport() if minify else None
+    options = {
+        "template": load_template(template_path, basepath, assets),
+        "cache": cache,
+        "block_cache": block_cache,
+        "index": index,
+        "assets": assets,
+        "minify": report,
+    }
+    start_counts = cache_counts(cache, block_cache)
+    counts = [0, 0, 0, 0]
+    progress = Progress(len(pages))
+
+    if io_concurrency > 0 and jobs <= 1 and profile is None:
+        asyncio.run(
+            generate_pages_async(
+                pages, template_path, basepath, io_concurrency, progress, **options
+            )
+        )
+        end_counts = cache_counts(cache, block_cache)
+        counts = [end - start for start, end in zip(start_counts, end_counts)]
+    elif jobs <= 1 or len(pages) <= 1:
+        for from_path, dest_path in pages:
+            if profile is None:
+                written = generate_page(
+                    from_path, template_path, dest_path, basepath, **options
+                )
+            else:
+                timer = StageTimer()
+                written = profile.run(
+                    generate_page,
+                    from_path,
+                    template_path,
+                    dest_path,
+                    basepath,
+                    timer=timer,
+                    **options,
+                )
+                profile.add_page(from_path, timer.stages)
+            progress.update(written)
+        end_counts = cache_counts(cache, block_cache)
+        counts = [end - start for start, end in zip(start_counts, end_counts)]
+    else:
+        job_list = [
+            (from_path, template_path, dest_path, basepath, profile is not None)
+            for from_path, dest_path in pages
+        ]
+        # Large chunks keep IPC overhead low, several per worker keep the load balanced
+        chunksize = max(1, len(job_list) // (jobs * 4))
+        worker_options = dict(
+            options, index=None if index is None else index.collector()
+        )
+
+        with ProcessPoolExecutor(
+            max_workers=jobs, initializer=_init_page_worker, initargs=(worker_options,)
+        ) as executor:
+            # map yields in submission order, so the report matches a serial build
+            for result in executor.map(
+                _generate_page_job, job_list, chunksize=chunksize
+            ):
+                from_path, dest_path, written = result[:3]
+                page_counts, stages, indexed, minified = result[3:]
+                log_generating(from_path, dest_path, template_path)
+                if index is not None:
+                    index.update(indexed)
+                if report is not None:
+                    report.extend(minified)
+                counts = [total + page for total, page in zip(counts, page_counts)]
+                if profile is not None:
+                    profile.add_page(from_path, stages)
+                progress.update(written)
+
+    progress.finish()
+
+    if report is not None:
+        report.log()
+
+    page_hits, page_misses, hits, misses = counts
+    if cache is not None:
+        log_event(
+            logging.INFO,
+            "render_cache",
+            f"Page cache: {page_hits} hits, {page_misses} misses",
+            hits=page_hits,
+            misses=page_misses,
+        )
+    if block_cache is not None:
+        log_event(
+            logging.INFO,
+            "block_cache",
+            f"Block cache: {hits} hits, {misses} misses",
+            hits=hits,
+            misses=misses,
+        )
+
+    if cache is not None:
+        cache.trim()
+
+
+def make_dest_dirs(dir_path_content, dest_dir_path):
+    for dir_path, dir_names, _ in os.walk(dir_path_content):
+        rel_dir = os.path.relpath(dir_path, dir_path_content)
+        for name in dir_names:
+            os.makedirs(os.path.join(dest_dir_path, rel_dir, name), exist_ok=True)
+
+
+def generate_pages_recursive(
+    dir_path_content,
+    template_path,
+    dest_dir_path,
+    basepath,
+    jobs=1,
+    cache=None,
+    block_cache=None,
+    profile=None,
+    io_concurrency=0,
+    index=None,
+    assets=None,
+    minify=False,
+):
+    make_dest_dirs(dir_path_content, dest_dir_path)
+    pages = collect_pages(dir_path_content, dest_dir_path)
+    generate_pages(
+        pages,
+        template_path,
+        basepath,
+        jobs,
+        cache,
+        block_cache,
+        profile,
+        io_concurrency,
+        index,
+        assets,
+        minify,
+    )
 
 
-def generate_pages_recursive(dir_path_content, template_path, dest_dir_path, basepath):
-    for item in os.listdir(dir_path_content):
+def collect_pages(dir_path_content, dest_dir_path):
+    pages = []
+    for item in sorted(os.listdir(dir_path_content)):
         if os.path.isdir(os.path.join(dir_path_content, item)):
-            new_dest_dir = os.path.join(dest_dir_path, item)
-            os.makedirs(new_dest_dir, exist_ok=True)
-            generate_pages_recursive(
-                os.path.join(dir_path_content, item),
-                template_path,
-                new_dest_dir,
-                basepath,
+            pages.extend(
+                collect_pages(
+                    os.path.join(dir_path_content, item),
+                    os.path.join(dest_dir_path, item),
+                )
             )
         elif item.endswith(".md"):
-            generate_page(
-                os.path.join(dir_path_content, item),
-                template_path,
-                os.path.join(dest_dir_path, item.replace(".md", ".html")),
-                basepath,
+            pages.append(
+                (
+                    os.path.join(dir_path_content, item),
+                    os.path.join(dest_dir_path, item.replace(".md", ".html")),
+                )
+            )
+    return pages
+
+
+def page_dest_path(from_path, dir_path_content, dest_dir_path):
+    rel_dir, item = os.path.split(os.path.relpath(from_path, dir_path_content))
+    return os.path.join(dest_dir_path, rel_dir, item.replace(".md", ".html"))
+
+
+# Dependency graph functions
+def url_path(url):
+    # Only site-root URLs can point into content/ or static/
+    if not url.startswith("/") or url.startswith("//"):
+        return None
+    return url.split("#", 1)[0].split("?", 1)[0].lstrip("/")
+
+
+def asset_dependency(url, dir_path_static):
+    path = url_path(url)
+    if not path:
+        return None
+    return os.path.normpath(os.path.join(dir_path_static, path))
+
+
+def link_dependency(url, dir_path_content, dir_path_static):
+    path = url_path(url)
+    if path is None:
+        return None
+    root, ext = os.path.splitext(path)
+    if ext == ".html":
+        return "link", os.path.normpath(os.path.join(dir_path_content, root + ".md"))
+    if ext:
+        # Links to downloads and stylesheets point at static files, not pages
+        return "asset", os.path.normpath(os.path.join(dir_path_static, path))
+    return "link", os.path.normpath(os.path.join(dir_path_content, path, "index.md"))
+
+
+def page_dependencies(markdown, template_path, dir_path_content, dir_path_static):
+    assets = set()
+    links = set()
+    for _, url in extract_markdown_images(markdown):
+        asset = asset_dependency(url, dir_path_static)
+        if asset is not None:
+            assets.add(asset)
+    for _, url in extract_markdown_links(markdown):
+        dependency = link_dependency(url, dir_path_content, dir_path_static)
+        if dependency is None:
+            continue
+        kind, path = dependency
+        (links if kind == "link" else assets).add(path)
+
+    return {
+        "template": os.path.normpath(template_path),
+        "assets": sorted(assets),
+        "links": sorted(links),
+    }
+
+
+# Incremental build functions
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint_file(path, previous=None):
+    # Hashing is skipped when size and mtime match the previous fingerprint
+    stat = os.stat(path)
+    fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if (
+        isinstance(previous, dict)
+        and previous.get("size") == stat.st_size
+        and previous.get("mtime_ns") == stat.st_mtime_ns
+        and "hash" in previous
+    ):
+        fingerprint["hash"] = previous["hash"]
+    else:
+        fingerprint["hash"] = hash_file(path)
+    return fingerprint
+
+
+def list_files(root):
+    files = []
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names.sort()
+        for name in sorted(file_names):
+            files.append(os.path.relpath(os.path.join(dir_path, name), root))
+    return files
+
+
+def load_manifest(manifest_path):
+    try:
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(manifest, dict):
+        return {}
+    return manifest
+
+
+def save_manifest(manifest_path, manifest):
+    manifest_dir = os.path.dirname(manifest_path)
+    if manifest_dir:
+        os.makedirs(manifest_dir, exist_ok=True)
+
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def remove_output(path, root):
+    if os.path.isfile(path):
+        os.remove(path)
+        log_removed(path)
+
+    # Prune directories left empty, but never the output root itself
+    root = os.path.abspath(root)
+    parent = os.path.dirname(os.path.abspath(path))
+    while parent != root and parent.startswith(root + os.sep):
+        if os.path.isdir(parent) and not os.listdir(parent):
+            os.rmdir(parent)
+        else:
+            break
+        parent = os.path.dirname(parent)
+
+
+def same_content(previous, fingerprint):
+    return isinstance(previous, dict) and previous.get("hash") == fingerprint["hash"]
+
+
+def build_incremental(
+    dir_path_content,
+    template_path,
+    dir_path_static,
+    dest_dir_path,
+    basepath,
+    manifest_path,
+    jobs=1,
+    cache=None,
+    block_cache=None,
+    profile=None,
+    io_concurrency=0,
+    explain=False,
+    index=None,
+    fingerprint_assets=False,
+    minify=False,
+    image_sizes=None,
+):
+    old_manifest = load_manifest(manifest_path)
+    old_static = old_manifest.get("static", {})
+    old_pages = old_manifest.get("pages", {})
+
+    new_manifest = {
+        "basepath": basepath,
+        "template": hash_file(template_path),
+        "static": {},
+        "pages": {},
+        "fingerprint": fingerprint_assets,
+        "minify": minify,
+        "image_sizes": image_sizes is not None,
+        "search": index is not None,
+    }
+
+    # Every input whose content changed, for the dependency graph to fan out
+    changes = {}
+    if old_manifest.get("template") != new_manifest["template"]:
+        changes[template_path] = "changed"
+
+    os.makedirs(dest_dir_path, exist_ok=True)
+
+    static_start = time.perf_counter()
+    for rel_path in list_files(dir_path_static):
+        src_path = os.path.join(dir_path_static, rel_path)
+        dest_path = os.path.join(dest_dir_path, rel_path)
+        previous = old_static.get(rel_path)
+        fingerprint = fingerprint_file(src_path, previous)
+        new_manifest["static"][rel_path] = fingerprint
+
+        if not same_content(previous, fingerprint):
+            changes[src_path] = "added" if previous is None else "changed"
+        elif os.path.exists(dest_path):
+            continue
+
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        if sync_file(src_path, dest_path):
+            log_copied(src_path, os.path.dirname(dest_path))
+
+    for rel_path in old_static:
+        if rel_path not in new_manifest["static"]:
+            changes[os.path.join(dir_path_static, rel_path)] = "removed"
+            remove_output(os.path.join(dest_dir_path, rel_path), dest_dir_path)
+    assets = None
+    if fingerprint_assets:
+        assets = asset_manifest(
+            {
+                rel_path: static_fingerprint["hash"]
+                for rel_path, static_fingerprint in new_manifest["static"].items()
+            },
+            image_sizes,
+        )
+    elif image_sizes is not None:
+        assets = asset_manifest({}, image_sizes)
+    publish_assets(
+        dir_path_static, dest_dir_path, assets if fingerprint_assets else None
+    )
+    if profile is not None:
+        profile.add_stage("static copy", time.perf_counter() - static_start)
+
+    # Fingerprinted URLs in the template change on every page at once
+    template_asset_reasons = []
+    if fingerprint_assets and old_manifest:
+        template = read_text(template_path)
+        template_urls = {url for _, url in Template.asset_pattern.findall(template)}
+        for path, change in sorted(changes.items()):
+            if site_url(os.path.relpath(path, dir_path_static)) in template_urls:
+                template_asset_reasons.append(f"template asset {change}: {path}")
+
+    pages = collect_pages(dir_path_content, dest_dir_path)
+    reasons = {}
+    for from_path, dest_path in pages:
+        previous = old_pages.get(from_path)
+        fingerprint = fingerprint_file(from_path, previous)
+        fingerprint["dest"] = dest_path
+        new_manifest["pages"][from_path] = fingerprint
+
+        # Unchanged pages keep the dependencies found when they last changed
+        if same_content(previous, fingerprint) and "deps" in previous:
+            fingerprint["deps"] = previous["deps"]
+        else:
+            changes[from_path] = "added" if previous is None else "changed"
+            fingerprint["deps"] = page_dependencies(
+                read_text(from_path), template_path, dir_path_content, dir_path_static
             )
+
+        page_reasons = reasons.setdefault(os.path.normpath(from_path), [])
+        if not old_manifest:
+            page_reasons.append("no previous build")
+        elif old_manifest.get("basepath") != basepath:
+            page_reasons.append("basepath changed")
+        elif old_manifest.get("fingerprint", False) != fingerprint_assets:
+            page_reasons.append("asset fingerprinting turned on or off")
+        elif old_manifest.get("minify", False) != minify:
+            page_reasons.append("minification turned on or off")
+        elif old_manifest.get("image_sizes", False) != new_manifest["image_sizes"]:
+            page_reasons.append("image sizes turned on or off")
+        elif old_manifest.get("search", False) != new_manifest["search"]:
+            page_reasons.append("search index turned on or off")
+        page_reasons.extend(template_asset_reasons)
+        if previous is not None and previous.get("dest") != dest_path:
+            page_reasons.append("output path changed")
+        elif not os.path.exists(dest_path):
+            page_reasons.append("output missing")
+        if index is not None and not index.has_page(dest_path):
+            page_reasons.append("not in search index")
+
+    for from_path in old_pages:
+        if from_path not in new_manifest["pages"]:
+            changes[from_path] = "removed"
+
+    # Removed pages are still in the old graph, which is what their linkers need
+    graph = DependencyGraph.from_manifest(new_manifest)
+    old_graph = DependencyGraph.from_manifest(old_manifest)
+    removals = {path: change for path, change in changes.items() if change == "removed"}
+    for page_reasons in (
+        graph.rebuild_reasons(changes) if old_manifest else {},
+        old_graph.rebuild_reasons(removals),
+    ):
+        for page, page_changes in page_reasons.items():
+            if page in reasons:
+                reasons[page].extend(
+                    reason for reason in page_changes if reason not in reasons[page]
+                )
+
+    stale_pages = [
+        (from_path, dest_path)
+        for from_path, dest_path in pages
+        if reasons[os.path.normpath(from_path)]
+    ]
+
+    # Always in the event log; --explain also shows them on the console
+    for from_path, dest_path in stale_pages:
+        page_reasons = reasons[os.path.normpath(from_path)]
+        log_event(
+            logging.INFO if explain else logging.DEBUG,
+            "rebuild_reason",
+            f"Rebuilding {from_path}: " + "; ".join(page_reasons),
+            src=from_path,
+            dest=dest_path,
+            reasons=page_reasons,
+        )
+
+    generate_pages(
+        stale_pages,
+        template_path,
+        basepath,
+        jobs,
+        cache,
+        block_cache,
+        profile,
+        io_concurrency,
+        index,
+        assets,
+        minify,
+    )
+    if index is not None:
+        index.retain([dest_path for _, dest_path in pages])
+
+    for from_path, previous in old_pages.items():
+        if from_path in new_manifest["pages"]:
+            continue
+        if previous.get("dest"):
+            remove_output(previous["dest"], dest_dir_path)
+
+    save_manifest(manifest_path, new_manifest)
+
+    return [dest_path for _, dest_path in stale_pages]
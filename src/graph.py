@@ -0,0 +1,41 @@
+import os
+
+
+# Reverse index from every input to the pages that depend on it
+class DependencyGraph:
+    def __init__(self, pages):
+        self.pages = pages
+        self.dependents = {}
+        for page, deps in pages.items():
+            self.add_edge(deps["template"], page, "template")
+            for asset in deps["assets"]:
+                self.add_edge(asset, page, "asset")
+            for link in deps["links"]:
+                self.add_edge(link, page, "link")
+
+    @classmethod
+    def from_manifest(cls, manifest):
+        return cls(
+            {
+                os.path.normpath(page): entry["deps"]
+                for page, entry in manifest.get("pages", {}).items()
+                if isinstance(entry, dict) and "deps" in entry
+            }
+        )
+
+    def add_edge(self, path, page, kind):
+        self.dependents.setdefault(path, []).append((page, kind))
+
+    def rebuild_reasons(self, changes):
+        # changes maps an input path to "changed", "added" or "removed"
+        reasons = {}
+        for path, change in sorted(changes.items()):
+            path = os.path.normpath(path)
+            if path in self.pages:
+                reasons.setdefault(path, []).append(f"source {change}")
+            for page, kind in self.dependents.get(path, ()):
+                # Links only matter when the target page appears or disappears
+                if kind == "link" and change == "changed":
+                    continue
+                reasons.setdefault(page, []).append(f"{kind} {change}: {path}")
+        return reasons
@@ -0,0 +1,167 @@
+import os
+import json
+import struct
+import logging
+from functions import list_files, fingerprint_file, site_url
+from log import log_event
+
+IMAGE_EXTENSIONS = frozenset({".png", ".jpg", ".jpeg", ".gif", ".webp"})
+
+# JPEG start-of-frame markers, the segments that hold the dimensions
+JPEG_SOF_MARKERS = frozenset(
+    {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+)
+# Markers with no length field after them
+JPEG_STANDALONE_MARKERS = frozenset({0x01, 0xD8, *range(0xD0, 0xD8)})
+
+
+# Header-only dimension probes: each reads a few bytes, never the pixel data
+def png_size(f, header):
+    if len(header) < 24 or header[12:16] != b"IHDR":
+        return None
+    return struct.unpack(">II", header[16:24])
+
+
+def gif_size(f, header):
+    if len(header) < 10:
+        return None
+    return struct.unpack("<HH", header[6:10])
+
+
+def webp_size(f, header):
+    # Every chunk's dimensions end within the first 30 bytes
+    if len(header) < 30:
+        return None
+    chunk = header[12:16]
+    if chunk == b"VP8 " and header[23:26] == b"\x9d\x01\x2a":
+        width, height = struct.unpack("<HH", header[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L" and header[20] == 0x2F:
+        bits = int.from_bytes(header[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        width = int.from_bytes(header[24:27], "little") + 1
+        height = int.from_bytes(header[27:30], "little") + 1
+        return width, height
+    return None
+
+
+def jpeg_size(f, header):
+    # Walks the segment headers, seeking over each segment's body
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b"\xff":
+            byte = f.read(1)
+        while byte == b"\xff":
+            byte = f.read(1)
+        if not byte:
+            return None
+
+        marker = byte[0]
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        if marker == 0xD9:
+            return None
+
+        length = f.read(2)
+        if len(length) < 2 or struct.unpack(">H", length)[0] < 2:
+            return None
+        if marker in JPEG_SOF_MARKERS:
+            frame = f.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack(">HH", frame[1:5])
+            return width, height
+        f.seek(struct.unpack(">H", length)[0] - 2, os.SEEK_CUR)
+
+
+IMAGE_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", png_size),
+    (b"GIF87a", gif_size),
+    (b"GIF89a", gif_size),
+    (b"\xff\xd8", jpeg_size),
+]
+
+
+def image_size(path):
+    # Returns (width, height), or None when the format is not recognized
+    with open(path, "rb") as f:
+        header = f.read(32)
+        if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+            size = webp_size(f, header)
+        else:
+            size = None
+            for signature, probe in IMAGE_SIGNATURES:
+                if header.startswith(signature):
+                    size = probe(f, header)
+                    break
+    if size is None or not all(size):
+        return None
+    return list(size)
+
+
+# Dimensions by content hash, so an image is probed once across builds
+class ImageSizeCache:
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self.sizes = {}
+        self.probes = 0
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+            self.files = data["files"]
+            self.sizes = data["sizes"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def lookup(self, path, digest):
+        if digest not in self.sizes:
+            self.probes += 1
+            self.sizes[digest] = image_size(path)
+            # Stored all the same, so a broken image is reported once, not every build
+            if self.sizes[digest] is None:
+                log_event(
+                    logging.WARNING,
+                    "image_size_unknown",
+                    f"Warning: could not read the dimensions of {path}",
+                    path=path,
+                )
+        return self.sizes[digest]
+
+    def image_sizes(self, dir_path_static):
+        # Unchanged files keep the hash recorded for their size and mtime
+        self.probes = 0
+        files = {}
+        used = set()
+        sizes = {}
+        for rel_path in list_files(dir_path_static):
+            if os.path.splitext(rel_path)[1].lower() not in IMAGE_EXTENSIONS:
+                continue
+            path = os.path.join(dir_path_static, rel_path)
+            files[rel_path] = fingerprint_file(path, self.files.get(rel_path))
+            digest = files[rel_path]["hash"]
+            used.add(digest)
+            size = self.lookup(path, digest)
+            if size is not None:
+                sizes[site_url(rel_path)] = size
+
+        # Only what the current static/ uses is kept
+        self.files = files
+        self.sizes = {digest: self.sizes[digest] for digest in sorted(used)}
+
+        log_event(
+            logging.INFO,
+            "image_sizes",
+            f"Image sizes: {len(sizes)} images, {self.probes} probed",
+            images=len(sizes),
+            probes=self.probes,
+        )
+        return sizes
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({"files": self.files, "sizes": self.sizes}, f, indent=2)
+        os.replace(self.path + ".tmp", self.path)
@@ -0,0 +1,90 @@
+import sys
+import json
+import time
+import logging
+
+logger = logging.getLogger("ssg")
+
+# Seconds between progress lines during a build
+PROGRESS_INTERVAL = 2.0
+
+
+# One JSON object per line, for tools that should not parse the text output
+class JSONLinesFormatter(logging.Formatter):
+    def format(self, record):
+        event = {
+            "time": record.created,
+            "level": record.levelname.lower(),
+            "event": getattr(record, "event", "message"),
+            "message": record.getMessage(),
+        }
+        event.update(getattr(record, "data", {}))
+        return json.dumps(event)
+
+
+def configure_logging(level=logging.INFO, json_path=None):
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setLevel(level)
+    console.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(console)
+
+    # The event stream records everything, whatever the console level is
+    if json_path is not None:
+        events = logging.FileHandler(json_path, mode="w")
+        events.setLevel(logging.DEBUG)
+        events.setFormatter(JSONLinesFormatter())
+        logger.addHandler(events)
+        level = logging.DEBUG
+
+    # Records below every handler's level are never even created
+    logger.setLevel(level)
+    logger.propagate = False
+
+
+def log_event(level, event, message, **data):
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra={"event": event, "data": data})
+
+
+# Periodic pages/sec and bytes written summary
+class Progress:
+    def __init__(self, total, interval=PROGRESS_INTERVAL):
+        self.total = total
+        self.interval = interval
+        self.pages = 0
+        self.bytes = 0
+        self.start = time.perf_counter()
+        self.last_report = self.start
+
+    def update(self, written):
+        self.pages += 1
+        self.bytes += written
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report("progress", now)
+
+    def finish(self):
+        self.report("done", time.perf_counter())
+
+    def report(self, event, now):
+        elapsed = now - self.start
+        rate = self.pages / elapsed if elapsed else 0.0
+        if event == "done":
+            message = f"Generated {self.pages} pages in {elapsed:.2f} s"
+        else:
+            message = f"Generated {self.pages}/{self.total} pages"
+        log_event(
+            logging.INFO,
+            event,
+            f"{message} ({rate:.1f} pages/s, {self.bytes / 1e6:.1f} MB written)",
+            pages=self.pages,
+            total=self.total,
+            bytes=self.bytes,
+            seconds=elapsed,
+            pages_per_second=rate,
+        )
@@ -1,17 +1,455 @@
 import os
-import shutil
 import sys
-from functions import copy_directory_contents, generate_pages_recursive
+import time
+import logging
+import argparse
+from functions import (
+    copy_directory_contents,
+    generate_pages_recursive,
+    build_incremental,
+    collect_pages,
+    load_manifest,
+    static_hashes,
+    asset_manifest,
+    asset_outputs,
+    publish_assets,
+)
+from watch import SiteWatcher, serve_directory
+from cache import RenderCache, BlockCache
+from profiling import BuildProfile
+from log import configure_logging, logger
+from graph import DependencyGraph
+from shard import parse_shard, shard_dest_dir, build_shard, merge_shards
+from compress import compress_outputs, remove_sidecars, MIN_COMPRESS_SIZE
+from imagesize import ImageSizeCache
+from search import (
+    SearchIndex,
+    SHARD_INDEX_FILE,
+    load_shard_indexes,
+    remove_search_index,
+)
+
+MANIFEST_PATH = os.path.join(".ssg-cache", "manifest.json")
+RENDER_CACHE_DIR = os.path.join(".ssg-cache", "pages")
+SHARD_DIR = "shards"
+GZIP_CACHE_DIR = os.path.join(".ssg-cache", "gzip")
+PROFILE_PATH = os.path.join(".ssg-cache", "profile.json")
+SEARCH_STATE_PATH = os.path.join(".ssg-cache", "search.json")
+IMAGE_SIZE_CACHE_PATH = os.path.join(".ssg-cache", "images.json")
+
+
+def add_compress_args(parser):
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="write .gz sidecars next to compressible outputs in docs/",
+    )
+    parser.add_argument(
+        "--compress-min-size",
+        type=int,
+        default=MIN_COMPRESS_SIZE,
+        metavar="BYTES",
+        help=f"skip files smaller than this (default {MIN_COMPRESS_SIZE})",
+    )
+
+
+def compress_docs(args):
+    if args.compress:
+        compress_outputs(
+            "docs", GZIP_CACHE_DIR, args.compress_min_size, os.cpu_count() or 1
+        )
+    else:
+        remove_sidecars("docs", GZIP_CACHE_DIR)
+
+
+def add_search_args(parser):
+    parser.add_argument(
+        "--search",
+        action="store_true",
+        help="write a sharded full-text search index to docs/search/",
+    )
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Build the static site into docs/")
+    parser.add_argument("basepath", nargs="?", default="/")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only rebuild pages and assets whose inputs changed since the last build",
+    )
+    parser.add_argument(
+        "--fingerprint",
+        action="store_true",
+        help="also publish static files under content-hashed names and link to those",
+    )
+    parser.add_argument(
+        "--image-sizes",
+        action="store_true",
+        help="add width, height and loading=lazy to images from static/",
+    )
+    parser.add_argument(
+        "--minify",
+        action="store_true",
+        help="strip comments and insignificant whitespace from generated pages",
+    )
+    add_compress_args(parser)
+    add_search_args(parser)
+    parser.add_argument(
+        "--shard",
+        metavar="K/N",
+        help="render only shard K of N (1-based) into --shard-dir/K;"
+        " combine the shards with the merge subcommand",
+    )
+    parser.add_argument("--shard-dir", default=SHARD_DIR)
+    parser.add_argument(
+        "--explain",
+        action="store_true",
+        help="with --incremental, list why each page is rebuilt",
+    )
+    parser.add_argument(
+        "--what-if",
+        action="append",
+        metavar="PATH",
+        help="list the pages an incremental build would rebuild if PATH changed,"
+        " then exit (repeatable)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="render pages on N worker processes (0 uses every CPU)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="do not use the rendered page cache in .ssg-cache/ or the block cache",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=512,
+        help="size limit of the rendered page cache in MB (default 512)",
+    )
+    parser.add_argument(
+        "--block-cache-size",
+        type=int,
+        default=64,
+        help="size limit of the in-memory rendered block cache in MB (default 64)",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="serve docs/ and rebuild changed pages and assets on save",
+    )
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=0.05,
+        help="seconds between scans of content/ and static/ in watch mode",
+    )
+    parser.add_argument(
+        "--io-concurrency",
+        type=int,
+        default=0,
+        metavar="N",
+        help="read and write up to N pages at once on an asyncio pipeline"
+        " (single process only, 0 disables)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=f"time each build stage per page and write a report to {PROFILE_PATH}"
+        " (the caches are bypassed)",
+    )
+    parser.add_argument(
+        "--profile-top",
+        type=int,
+        default=10,
+        help="number of slowest pages listed in the profile report (default 10)",
+    )
+    parser.add_argument(
+        "--cprofile",
+        metavar="PATH",
+        help="with --profile, also dump cProfile stats of generate_page to PATH",
+    )
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument(
+        "-q",
+        "--quiet",
+        action="store_true",
+        help="only report warnings and errors",
+    )
+    verbosity.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="report every generated page and copied file",
+    )
+    parser.add_argument(
+        "--log-json",
+        metavar="PATH",
+        help="write every build event to PATH as JSON lines",
+    )
+    args = parser.parse_args(argv)
+    if args.shard:
+        try:
+            args.shard = parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+        if args.incremental or args.watch:
+            parser.error("--shard cannot be combined with --incremental or --watch")
+    if args.fingerprint and (args.shard or args.watch):
+        parser.error("--fingerprint cannot be combined with --shard or --watch")
+    if args.image_sizes and args.watch:
+        parser.error("--image-sizes cannot be combined with --watch")
+    if args.compress and args.watch:
+        parser.error("--compress cannot be combined with --watch")
+    if args.search and args.watch:
+        parser.error("--search cannot be combined with --watch")
+    if args.explain and not args.incremental:
+        parser.error("--explain requires --incremental")
+    if args.cprofile and not args.profile:
+        parser.error("--cprofile requires --profile")
+    if args.cprofile and args.jobs != 1:
+        parser.error("--cprofile only works with --jobs 1")
+    if args.io_concurrency < 0:
+        parser.error("--io-concurrency must be zero or a positive integer")
+    if args.io_concurrency and args.jobs != 1:
+        parser.error("--io-concurrency only works with --jobs 1")
+    if args.jobs < 0:
+        parser.error("--jobs must be zero or a positive integer")
+    if args.jobs == 0:
+        args.jobs = os.cpu_count() or 1
+    return args
+
+
+def make_cache(args):
+    if args.no_cache or args.profile:
+        return None
+    return RenderCache(RENDER_CACHE_DIR, args.cache_size * 1024 * 1024)
+
+
+def make_block_cache(args):
+    if args.no_cache or args.profile:
+        return None
+    return BlockCache(args.block_cache_size * 1024 * 1024)
+
+
+def parse_merge_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="main.py merge",
+        description="Check that the shards are disjoint and complete,"
+        " then combine them and static/ into docs/",
+    )
+    parser.add_argument("--shard-dir", default=SHARD_DIR)
+    parser.add_argument(
+        "--verify-only",
+        action="store_true",
+        help="only check the shards, do not write docs/",
+    )
+    add_compress_args(parser)
+    add_search_args(parser)
+    return parser.parse_args(argv)
+
+
+def build(args, block_cache=None, profile=None):
+    basepath = args.basepath
+    cache = make_cache(args)
+    sizes = image_sizes(args)
+
+    if args.shard:
+        index, count = args.shard
+        dest_dir_path = shard_dest_dir(args.shard_dir, index)
+        search_index = SearchIndex(dest_dir_path) if args.search else None
+        build_shard(
+            "content",
+            "template.html",
+            args.shard_dir,
+            basepath,
+            index,
+            count,
+            jobs=args.jobs,
+            cache=cache,
+            block_cache=block_cache,
+            profile=profile,
+            io_concurrency=args.io_concurrency,
+            index=search_index,
+            assets=None if sizes is None else asset_manifest({}, sizes),
+            minify=args.minify,
+        )
+        if search_index is not None:
+            search_index.save(os.path.join(dest_dir_path, SHARD_INDEX_FILE))
+        return
+
+    if args.incremental:
+        search_index = None
+        if args.search:
+            search_index = SearchIndex.load(SEARCH_STATE_PATH, "docs")
+        build_incremental(
+            "content",
+            "template.html",
+            "static",
+            "docs",
+            basepath,
+            MANIFEST_PATH,
+            jobs=args.jobs,
+            cache=cache,
+            block_cache=block_cache,
+            profile=profile,
+            io_concurrency=args.io_concurrency,
+            explain=args.explain,
+            index=search_index,
+            fingerprint_assets=args.fingerprint,
+            minify=args.minify,
+            image_sizes=sizes,
+        )
+        write_search_index(search_index, basepath)
+        compress_docs(args)
+        return
+
+    # Sync static/ into docs/, deleting everything that is neither a static file
+    # nor one of the pages about to be generated
+    pages = collect_pages("content", "docs")
+    keep = {os.path.normpath(dest_path) for _, dest_path in pages}
+    static_start = time.perf_counter()
+    assets = None
+    if args.fingerprint:
+        assets = asset_manifest(static_hashes("static"), sizes)
+        keep |= asset_outputs("docs", assets)
+    elif sizes is not None:
+        assets = asset_manifest({}, sizes)
+    copy_directory_contents("static", f"docs", keep=keep)
+    if args.fingerprint:
+        publish_assets("static", "docs", assets)
+    # A full build indexes every page, so it starts from an empty index
+    search_index = SearchIndex("docs") if args.search else None
+    if profile is not None:
+        profile.add_stage("static copy", time.perf_counter() - static_start)
+    generate_pages_recursive(
+        "content",
+        "template.html",
+        f"docs",
+        basepath,
+        jobs=args.jobs,
+        cache=cache,
+        block_cache=block_cache,
+        profile=profile,
+        io_concurrency=args.io_concurrency,
+        index=search_index,
+        assets=assets,
+        minify=args.minify,
+    )
+
+    write_search_index(search_index, basepath)
+    compress_docs(args)
+
+    remove_manifest()
+
+
+def remove_manifest():
+    # Full builds and merges leave the manifest stale, so the next incremental
+    # run starts over
+    if os.path.exists(MANIFEST_PATH):
+        os.remove(MANIFEST_PATH)
+
+
+def image_sizes(args):
+    if not args.image_sizes:
+        return None
+    cache = ImageSizeCache(IMAGE_SIZE_CACHE_PATH)
+    sizes = cache.image_sizes("static")
+    cache.save()
+    return sizes
+
+
+def write_search_index(search_index, basepath):
+    if search_index is not None:
+        search_index.save(SEARCH_STATE_PATH)
+        search_index.write(basepath)
+    else:
+        remove_search_index("docs", SEARCH_STATE_PATH)
+
+
+def what_if(paths):
+    graph = DependencyGraph.from_manifest(load_manifest(MANIFEST_PATH))
+    if not graph.pages:
+        print(f"No dependency graph in {MANIFEST_PATH}, run an --incremental build")
+        return
+    reasons = graph.rebuild_reasons({path: "changed" for path in paths})
+    for page, page_reasons in sorted(reasons.items()):
+        print(f"{page}: {'; '.join(page_reasons)}")
+    if not reasons:
+        print("No pages depend on " + ", ".join(paths))
 
 
 # Main function
-def main():
-    basepath = sys.argv[1] if len(sys.argv) > 1 else "/"
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["merge"]:
+        args = parse_merge_args(argv[1:])
+        configure_logging()
+        try:
+            merge_shards(args.shard_dir, "content", "static", "docs", args.verify_only)
+            if not args.verify_only:
+                if args.search:
+                    write_search_index(*load_shard_indexes(args.shard_dir, "docs"))
+                else:
+                    write_search_index(None, None)
+        except ValueError as e:
+            sys.exit(str(e))
+        if not args.verify_only:
+            compress_docs(args)
+            remove_manifest()
+        return
+
+    args = parse_args(argv)
+
+    if args.quiet:
+        level = logging.WARNING
+    elif args.verbose:
+        level = logging.DEBUG
+    else:
+        level = logging.INFO
+    configure_logging(level, args.log_json)
+
+    if args.what_if:
+        what_if(args.what_if)
+        return
+
+    # One block cache serves the initial build and every watch-mode rebuild
+    block_cache = make_block_cache(args)
+
+    # Scan before building so that edits made during the build are still seen
+    if args.watch:
+        watcher = SiteWatcher(
+            "content",
+            "template.html",
+            "static",
+            "docs",
+            args.basepath,
+            make_cache(args),
+            block_cache,
+            args.minify,
+        )
+
+    profile = BuildProfile(args.cprofile) if args.profile else None
+
+    build(args, block_cache, profile)
+
+    if profile is not None:
+        profile.save(PROFILE_PATH, args.profile_top)
+        print(profile.format_table(args.profile_top))
+        logger.info(f"Wrote profile to {PROFILE_PATH}")
 
-    shutil.rmtree("docs", ignore_errors=True)  # Clear the public directory
-    os.makedirs("docs", exist_ok=True)
-    copy_directory_contents("static", f"docs")
-    generate_pages_recursive("content", "template.html", f"docs", basepath)
+    if args.watch:
+        server = serve_directory("docs", args.port)
+        try:
+            watcher.run(args.poll_interval)
+        except KeyboardInterrupt:
+            server.shutdown()
 
 
 if __name__ == "__main__":
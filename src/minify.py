@@ -0,0 +1,162 @@
+import re
+import logging
+from log import log_event
+
+# Whitespace next to these tags never renders, so it is dropped entirely
+BLOCK_TAGS = frozenset("""
+    !doctype html head body title meta link script style base
+    article aside main div p h1 h2 h3 h4 h5 h6 ul ol li dl dt dd
+    blockquote pre section header footer nav figure figcaption hr br
+    table thead tbody tfoot tr td th form fieldset
+    """.split())
+# Content of these tags is written exactly as it arrives
+RAW_TAGS = frozenset({"pre", "code", "textarea", "script", "style"})
+
+# A "<" with no tag or comment closing within this many bytes is text, so
+# unescaped prose like "n<max it's" is never buffered to the end of the page
+MAX_TAG_LENGTH = 4096
+TAG = re.compile(r"""<[^>"']*(?:(?:"[^"]*"|'[^']*')[^>"']*)*>""")
+TAG_NAME = re.compile(r"</?([A-Za-z!][^\s/>]*)")
+WHITESPACE = re.compile(r"\s+")
+
+
+# Streaming minifier: feed it chunks, it writes the minified HTML
+class HTMLMinifier:
+    def __init__(self, write):
+        self.write = write
+        self.buffer = ""
+        self.raw = None
+        self.space = False
+        self.after_block = True
+        self.size = 0
+
+    def feed(self, chunk):
+        self.size += len(chunk.encode("utf-8"))
+        text = self.buffer + chunk
+        self.buffer = text[self.consume(text) :]
+
+    def close(self):
+        # Whatever never completed, like an unclosed comment, goes out unchanged
+        if self.buffer:
+            self.write(self.buffer)
+            self.buffer = ""
+
+    def consume(self, text):
+        # Returns how much of text was written; the rest waits for the next chunk
+        position = 0
+        end = len(text)
+        while position < end:
+            if self.raw is not None:
+                match = self.raw.search(text, position)
+                if match is None:
+                    # A closing tag may be split across chunks
+                    safe = max(position, end - 16)
+                    self.write(text[position:safe])
+                    return safe
+                self.write(text[position : match.start()])
+                position = match.start()
+                self.raw = None
+
+            window = position + MAX_TAG_LENGTH
+            if text.startswith("<!--", position):
+                close = text.find("-->", position + 4, window)
+                if close != -1:
+                    # Conditional comments are markup for old browsers, not comments
+                    if text.startswith("<!--[if", position):
+                        self.tag(text[position : close + 3], None)
+                    position = close + 3
+                    continue
+                if end < window:
+                    return position
+
+            elif text[position] == "<":
+                if end - position < 4:
+                    return position
+                name = TAG_NAME.match(text, position)
+                if name is not None:
+                    tag = TAG.match(text, position, window)
+                    if tag is not None:
+                        self.tag(tag.group(), name.group(1).lower())
+                        position = tag.end()
+                        continue
+                    if end < window:
+                        return position
+
+            # Text runs to the next "<"; a "<" that starts no tag is text too
+            next_tag = text.find("<", position + 1)
+            if next_tag == -1:
+                next_tag = end
+            self.text(text[position:next_tag])
+            position = next_tag
+        return position
+
+    def tag(self, tag, name):
+        closing = tag.startswith("</")
+        block = name in BLOCK_TAGS
+        if self.space and not block and not self.after_block:
+            self.write(" ")
+        self.space = False
+        self.after_block = block
+        self.write(tag)
+        if name in RAW_TAGS and not closing and not tag.endswith("/>"):
+            self.raw = re.compile(rf"</{name}[\s>]", re.IGNORECASE)
+
+    def text(self, text):
+        body = WHITESPACE.sub(" ", text.strip())
+        if not body:
+            self.space = self.space or bool(text)
+            return
+        if (self.space or text[0].isspace()) and not self.after_block:
+            self.write(" ")
+        self.write(body)
+        self.space = text[-1].isspace()
+        self.after_block = False
+
+
+def minify_html(html):
+    out = []
+    minifier = HTMLMinifier(out.append)
+    minifier.feed(html)
+    minifier.close()
+    return "".join(out)
+
+
+# Bytes saved per page, reported once the pages are written
+class MinifyReport:
+    def __init__(self):
+        self.pages = []
+
+    def add(self, path, size, minified_size):
+        self.pages.append((path, size, minified_size))
+
+    def take(self):
+        # Worker processes send back what they minified with each result
+        pages = self.pages
+        self.pages = []
+        return pages
+
+    def extend(self, pages):
+        self.pages.extend(pages)
+
+    def log(self):
+        for path, size, minified_size in self.pages:
+            log_event(
+                logging.DEBUG,
+                "minify",
+                f"Minified {path}: {size} -> {minified_size} bytes"
+                f" ({size - minified_size} saved)",
+                path=path,
+                bytes=size,
+                minified_bytes=minified_size,
+            )
+        size = sum(page[1] for page in self.pages)
+        saved = size - sum(page[2] for page in self.pages)
+        log_event(
+            logging.INFO,
+            "minify_total",
+            f"Minified {len(self.pages)} pages: {saved / 1e3:.1f} kB saved"
+            f" ({saved / size if size else 0.0:.1%})",
+            pages=len(self.pages),
+            bytes=size,
+            saved_bytes=saved,
+        )
@@ -0,0 +1,97 @@
+import os
+import json
+import time
+import cProfile
+
+PAGE_STAGES = (
+    "read",
+    "block split",
+    "classify",
+    "inline",
+    "tree build",
+    "to_html",
+    "template",
+    "write",
+)
+
+
+# Per-page stage timer
+class StageTimer:
+    def __init__(self):
+        self.stages = dict.fromkeys(PAGE_STAGES, 0.0)
+        self.nested = 0.0
+
+    def call(self, stage, func, *args):
+        # Time spent in nested calls is charged to their own stage, not to this one
+        outer = self.nested
+        self.nested = 0.0
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stages[stage] += elapsed - self.nested
+            self.nested = outer + elapsed
+
+
+# Whole-build profile
+class BuildProfile:
+    def __init__(self, cprofile_path=None):
+        self.pages = []
+        self.stages = {}
+        self.cprofile_path = cprofile_path
+        self.cprofile = cProfile.Profile() if cprofile_path else None
+
+    def add_stage(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_page(self, path, stages):
+        self.pages.append((path, stages))
+        for stage, seconds in stages.items():
+            self.add_stage(stage, seconds)
+
+    def run(self, func, *args, **kwargs):
+        if self.cprofile is None:
+            return func(*args, **kwargs)
+        return self.cprofile.runcall(func, *args, **kwargs)
+
+    def slowest(self, count):
+        pages = sorted(self.pages, key=lambda page: sum(page[1].values()), reverse=True)
+        return pages[:count]
+
+    def to_json(self, count):
+        return {
+            "pages": len(self.pages),
+            "stages": self.stages,
+            "total": sum(self.stages.values()),
+            "slowest": [
+                {"path": path, "total": sum(stages.values()), "stages": stages}
+                for path, stages in self.slowest(count)
+            ],
+        }
+
+    def format_table(self, count):
+        total = sum(self.stages.values())
+        lines = [f"{'stage':>12} {'time (ms)':>10} {'share':>6}"]
+        for stage, seconds in self.stages.items():
+            share = seconds / total if total else 0.0
+            lines.append(f"{stage:>12} {seconds * 1000:>10.1f} {share:>6.1%}")
+        lines.append(f"{'total':>12} {total * 1000:>10.1f}")
+
+        lines.append("")
+        lines.append(
+            f"Slowest {min(count, len(self.pages))} of {len(self.pages)} pages:"
+        )
+        header = "".join(f" {stage:>11}" for stage in PAGE_STAGES)
+        lines.append(f"{'total (ms)':>10}{header}  page")
+        for path, stages in self.slowest(count):
+            row = "".join(f" {stages[stage] * 1000:>11.2f}" for stage in PAGE_STAGES)
+            lines.append(f"{sum(stages.values()) * 1000:>10.2f}{row}  {path}")
+        return "\n".join(lines)
+
+    def save(self, json_path, count):
+        os.makedirs(os.path.dirname(json_path) or ".", exist_ok=True)
+        with open(json_path, "w") as f:
+            json.dump(self.to_json(count), f, indent=2)
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(self.cprofile_path)
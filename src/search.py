@@ -0,0 +1,198 @@
+import os
+import re
+import json
+import logging
+from functions import rewrite_url, remove_output, open_output
+from log import log_event
+from shard import load_shard_manifests
+
+# Words of two or more word characters, matched after lowercasing; markup is
+# gone by then, so an underscore left is part of a name like snake_case
+TERM = re.compile(r"\w{2,}")
+# Terms are sharded by this many leading characters
+PREFIX_LENGTH = 2
+SEARCH_DIR = "search"
+PAGES_FILE = "pages.json"
+SHARD_INDEX_FILE = ".search.json"
+
+
+def shard_key(term):
+    # File-safe name of a term's shard; clients derive it the same way
+    prefix = term[:PREFIX_LENGTH]
+    if prefix.isascii() and prefix.isalnum():
+        return prefix
+    return "x" + prefix.encode("utf-8").hex()
+
+
+# Forward index of one page, fed the text of each block as the renderer walks it
+class PageTerms:
+    def __init__(self, title):
+        self.title = title
+        self.terms = {}
+        self.count = 0
+
+    def feed(self, text):
+        for match in TERM.finditer(text.lower()):
+            self.terms.setdefault(match.group(), []).append(self.count)
+            self.count += 1
+
+    def to_json(self):
+        return {"title": self.title, "terms": self.terms}
+
+
+# Sharded inverted index over every generated page
+class SearchIndex:
+    def __init__(self, dest_dir_path, pages=None):
+        self.dest_dir_path = dest_dir_path
+        self.pages = pages if pages is not None else {}
+
+    @classmethod
+    def load(cls, state_path, dest_dir_path):
+        try:
+            with open(state_path, "r") as f:
+                pages = json.load(f)["pages"]
+        except (OSError, ValueError, KeyError):
+            pages = {}
+        return cls(dest_dir_path, pages)
+
+    def save(self, state_path):
+        os.makedirs(os.path.dirname(state_path) or ".", exist_ok=True)
+        with open(state_path + ".tmp", "w") as f:
+            pages = {key: self.entry(key) for key in self.pages}
+            json.dump({"pages": pages}, f, separators=(",", ":"))
+        os.replace(state_path + ".tmp", state_path)
+
+    def page_key(self, dest_path):
+        rel_path = os.path.relpath(dest_path, self.dest_dir_path)
+        return rel_path.replace(os.sep, "/")
+
+    def start_page(self, dest_path, title):
+        page = PageTerms(title)
+        self.pages[self.page_key(dest_path)] = page
+        return page
+
+    def add_page(self, dest_path, title, text):
+        self.start_page(dest_path, title).feed(text)
+
+    def has_page(self, dest_path):
+        return self.page_key(dest_path) in self.pages
+
+    def retain(self, dest_paths):
+        # Drops pages that were removed or moved since the index was saved
+        keys = {self.page_key(dest_path) for dest_path in dest_paths}
+        for key in set(self.pages) - keys:
+            del self.pages[key]
+
+    def collector(self):
+        # Worker processes index into an empty copy and send back what they took
+        return SearchIndex(self.dest_dir_path)
+
+    def take(self):
+        pages = {key: self.entry(key) for key in self.pages}
+        self.pages = {}
+        return pages
+
+    def update(self, pages):
+        self.pages.update(pages)
+
+    def entry(self, key):
+        # Pages indexed in this build are PageTerms, loaded ones plain dicts
+        page = self.pages[key]
+        return page.to_json() if isinstance(page, PageTerms) else page
+
+    def shards(self):
+        # Page ids are positions in path order, listed in pages.json
+        keys = sorted(self.pages)
+        postings = {}
+        for page_id, key in enumerate(keys):
+            for term, positions in self.entry(key)["terms"].items():
+                postings.setdefault(term, []).append((page_id, positions))
+
+        shards = {}
+        for term in sorted(postings):
+            # [page id delta, position count, position deltas..., page id delta, ...]
+            encoded = []
+            previous_id = 0
+            for page_id, positions in postings[term]:
+                encoded += [page_id - previous_id, len(positions)]
+                encoded += [b - a for a, b in zip([0] + positions, positions)]
+                previous_id = page_id
+            shards.setdefault(shard_key(term), {})[term] = encoded
+        return keys, shards
+
+    def write(self, basepath):
+        search_dir = os.path.join(self.dest_dir_path, SEARCH_DIR)
+        os.makedirs(search_dir, exist_ok=True)
+
+        keys, shards = self.shards()
+        pages = []
+        for key in keys:
+            url = "/" + key
+            if url.endswith("/index.html"):
+                url = url[: -len("index.html")]
+            pages.append([rewrite_url(url, basepath), self.entry(key)["title"]])
+
+        files = {
+            PAGES_FILE: {
+                "prefix": PREFIX_LENGTH,
+                "pages": pages,
+                "shards": sorted(shards),
+            }
+        }
+        for name, terms in shards.items():
+            files[f"{name}.json"] = terms
+
+        written = 0
+        for name, data in files.items():
+            if write_if_changed(os.path.join(search_dir, name), data):
+                written += 1
+        for name in sorted(set(os.listdir(search_dir)) - set(files)):
+            remove_output(os.path.join(search_dir, name), self.dest_dir_path)
+
+        log_event(
+            logging.INFO,
+            "search_index",
+            f"Search index: {len(keys)} pages, {len(shards)} shards"
+            f" ({written} files written)",
+            pages=len(keys),
+            shards=len(shards),
+            written=written,
+        )
+
+
+def remove_search_index(dest_dir_path, state_path):
+    # A build without --search would leave the old index published and stale
+    search_dir = os.path.join(dest_dir_path, SEARCH_DIR)
+    if os.path.isdir(search_dir):
+        # remove_output also removes the directory once it is empty
+        for name in sorted(os.listdir(search_dir)):
+            remove_output(os.path.join(search_dir, name), dest_dir_path)
+    if os.path.exists(state_path):
+        os.remove(state_path)
+
+
+def write_if_changed(path, data):
+    text = json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            if f.read() == text:
+                return False
+    except OSError:
+        pass
+    with open_output(path, encoding="utf-8") as f:
+        f.write(text)
+    return True
+
+
+# Sharded builds: each shard saves its pages, the merge writes the index
+def load_shard_indexes(shard_dir, dest_dir_path):
+    index = SearchIndex(dest_dir_path)
+    manifests = load_shard_manifests(shard_dir)
+    for manifest in manifests:
+        path = os.path.join(manifest["directory"], SHARD_INDEX_FILE)
+        if not os.path.isfile(path):
+            raise ValueError(
+                f"Error: shard {manifest['shard']} was built without --search"
+            )
+        index.update(SearchIndex.load(path, dest_dir_path).pages)
+    return index, manifests[0]["basepath"]
@@ -0,0 +1,177 @@
+import os
+import json
+import shutil
+import hashlib
+from functions import (
+    hash_file,
+    collect_pages,
+    generate_pages,
+    copy_directory_contents,
+    sync_file,
+    log_copied,
+)
+
+SHARD_MANIFEST = ".shard.json"
+
+
+# Deterministic page partition
+def parse_shard(value):
+    index, _, count = value.partition("/")
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise ValueError(f"Error: invalid shard {value!r}, expected K/N")
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"Error: invalid shard {value!r}, need 1 <= K <= N")
+    return index, count
+
+
+def portable_path(path, root):
+    # Shard manifests are compared across machines, so always use "/"
+    return os.path.relpath(path, root).replace(os.sep, "/")
+
+
+def shard_of(rel_path, count):
+    digest = hashlib.sha256(rel_path.encode()).digest()
+    return int.from_bytes(digest[:8], "big") % count + 1
+
+
+def content_digest(dir_path_content, rel_paths):
+    # Covers each page's source as well as the page list, so a shard built from
+    # an older version of any page does not match
+    digest = hashlib.sha256()
+    for rel_path in sorted(rel_paths):
+        path = os.path.join(dir_path_content, *rel_path.split("/"))
+        digest.update(f"{rel_path}\0{hash_file(path)}\n".encode())
+    return digest.hexdigest()
+
+
+def shard_dest_dir(shard_dir, index):
+    return os.path.join(shard_dir, str(index))
+
+
+# Shard builds
+def build_shard(
+    dir_path_content, template_path, shard_dir, basepath, shard, count, **options
+):
+    dest_dir_path = shard_dest_dir(shard_dir, shard)
+    shutil.rmtree(dest_dir_path, ignore_errors=True)
+    os.makedirs(dest_dir_path)
+
+    all_pages = collect_pages(dir_path_content, dest_dir_path)
+    rel_sources = [portable_path(src, dir_path_content) for src, _ in all_pages]
+    pages = [
+        page
+        for page, rel_src in zip(all_pages, rel_sources)
+        if shard_of(rel_src, count) == shard
+    ]
+
+    generate_pages(pages, template_path, basepath, **options)
+
+    manifest = {
+        "shard": shard,
+        "count": count,
+        "basepath": basepath,
+        "content": content_digest(dir_path_content, rel_sources),
+        "pages": {
+            portable_path(src, dir_path_content): portable_path(dest, dest_dir_path)
+            for src, dest in pages
+        },
+    }
+    with open(os.path.join(dest_dir_path, SHARD_MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return [dest for _, dest in pages]
+
+
+def load_shard_manifests(shard_dir):
+    manifests = []
+    if not os.path.isdir(shard_dir):
+        return manifests
+    for name in sorted(os.listdir(shard_dir)):
+        path = os.path.join(shard_dir, name, SHARD_MANIFEST)
+        if os.path.isfile(path):
+            with open(path, "r") as f:
+                manifest = json.load(f)
+            # Shards may be fetched from CI under any directory name
+            manifest["directory"] = os.path.dirname(path)
+            manifests.append(manifest)
+    return manifests
+
+
+def verify_shards(manifests, rel_sources, content):
+    problems = []
+    if not manifests:
+        return ["no shard manifests found"]
+
+    count = manifests[0]["count"]
+    seen = {}
+    for manifest in manifests:
+        index = manifest["shard"]
+        if manifest["count"] != count:
+            problems.append(f"shard {index} is one of {manifest['count']}, not {count}")
+        if manifest["basepath"] != manifests[0]["basepath"]:
+            problems.append(f"shard {index} was built for another basepath")
+        if manifest["content"] != content:
+            problems.append(f"shard {index} was built from different content")
+        if index in seen:
+            problems.append(f"shard {index} appears more than once")
+        seen[index] = manifest
+
+    missing = sorted(set(range(1, count + 1)) - set(seen))
+    if missing:
+        problems.append(f"missing shards: {', '.join(map(str, missing))}")
+
+    # Disjoint: every page is in the shard its hash picks, and only there
+    owners = {}
+    for index, manifest in sorted(seen.items()):
+        for rel_src in manifest["pages"]:
+            if rel_src in owners:
+                problems.append(f"{rel_src} is in shards {owners[rel_src]} and {index}")
+            elif shard_of(rel_src, count) != index:
+                problems.append(f"{rel_src} does not belong in shard {index}")
+            owners.setdefault(rel_src, index)
+
+    # Complete: the shards cover every page in content/
+    for rel_src in sorted(set(rel_sources) - set(owners)):
+        problems.append(f"{rel_src} is in no shard")
+
+    return problems
+
+
+def merge_shards(
+    shard_dir, dir_path_content, dir_path_static, dest_dir_path, verify_only=False
+):
+    manifests = load_shard_manifests(shard_dir)
+    rel_sources = [
+        portable_path(src, dir_path_content)
+        for src, _ in collect_pages(dir_path_content, dest_dir_path)
+    ]
+    problems = verify_shards(
+        manifests, rel_sources, content_digest(dir_path_content, rel_sources)
+    )
+    if problems:
+        raise ValueError(
+            "Error: shards are not disjoint and complete:\n  " + "\n  ".join(problems)
+        )
+    if verify_only:
+        return []
+
+    pages = []
+    for manifest in manifests:
+        for rel_dest in manifest["pages"].values():
+            pages.append(
+                (
+                    os.path.join(manifest["directory"], *rel_dest.split("/")),
+                    os.path.join(dest_dir_path, *rel_dest.split("/")),
+                )
+            )
+
+    keep = {os.path.normpath(dest) for _, dest in pages}
+    copy_directory_contents(dir_path_static, dest_dir_path, keep=keep)
+    for src, dest in sorted(pages):
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        if sync_file(src, dest):
+            log_copied(src, os.path.dirname(dest))
+
+    return [dest for _, dest in pages]
@@ -1,10 +1,37 @@
+import io
+import os
+import gzip
+import json
+import time
+import shutil
+import struct
+import logging
+import tempfile
 import unittest
-
-from classes import TextNode, TextType, HTMLNode, LeafNode, ParentNode, BlockType
+from contextlib import redirect_stdout
+
+import functions
+from unittest import mock
+
+from benchmark import make_document, parse_mix, compare_reports
+from cache import RenderCache, BlockCache
+from profiling import StageTimer, BuildProfile, PAGE_STAGES
+from log import logger, configure_logging, Progress
+from graph import DependencyGraph
+from compress import compress_outputs, compressible_files, remove_sidecars
+from search import SearchIndex, PageTerms, shard_key, remove_search_index
+from minify import HTMLMinifier, minify_html
+from imagesize import image_size, ImageSizeCache
+from shard import parse_shard, shard_of, build_shard, merge_shards, load_shard_manifests, verify_shards
+from watch import SiteWatcher, snapshot_files, diff_snapshots
+from classes import TextNode, TextType, HTMLNode, LeafNode, ParentNode, BlockType, Template, AssetManifest
 from functions import (
     text_node_to_html, extract_markdown_images, extract_markdown_links,
     split_nodes_delimiter, split_nodes_image, split_nodes_link,
-    text_to_textnodes, markdown_to_blocks, block_to_blocktype, markdown_to_html_node, extract_title
+    text_to_textnodes, text_to_textnodes_legacy, markdown_to_blocks, block_to_blocktype, markdown_to_html_node, extract_title,
+    collect_pages, build_incremental, generate_pages_recursive, generate_page, generate_pages,
+    iter_markdown_blocks, iter_block_spans, render_blocks_into, copy_directory_contents, sync_file,
+    page_dependencies, load_manifest, render_cache_key, static_hashes, asset_manifest, publish_assets
 )
 
 
@@ -90,6 +117,13 @@ class TestTextNode(unittest.TestCase):
         self.assertEqual(node.text_type, TextType.TEXT)
 
 
+    def test_slots_no_instance_dict(self):
+        node = TextNode("text", TextType.TEXT)
+        self.assertFalse(hasattr(node, "__dict__"))
+        with self.assertRaises(AttributeError):
+            node.extra = 1
+
+
 class TestHTMLNode(unittest.TestCase):
     def test_eq_paragraph(self):
         node = HTMLNode("p", "This is a paragraph")
@@ -252,6 +286,15 @@ class TestHTMLNode(unittest.TestCase):
         self.assertNotEqual(node.children, None)
 
 
+    def test_slots_no_instance_dict(self):
+        for node in [
+            HTMLNode("p", "text"),
+            LeafNode("b", "bold"),
+            ParentNode("div", [LeafNode(None, "x")]),
+        ]:
+            self.assertFalse(hasattr(node, "__dict__"))
+
+
 class TestLeafNode(unittest.TestCase):
     def test_leaf_to_html_p(self):
         node = LeafNode("p", "This is a paragraph")
@@ -453,6 +496,25 @@ class TestParentNode(unittest.TestCase):
         parent_node2 = ParentNode("div", [child_node2], {"class": "container"})
         self.assertEqual(parent_node1, parent_node2)
 
+    def test_render_into_list(self):
+        node = ParentNode("p", [LeafNode("b", "bold"), LeafNode(None, " text")])
+        out = []
+        node.render_into(out.append)
+        self.assertEqual(out, ["<p>", "<b>bold</b>", " text", "</p>"])
+
+    def test_render_into_stream(self):
+        node = ParentNode(
+            "ul", [ParentNode("li", [LeafNode("a", "x", {"href": "/x"})])]
+        )
+        out = io.StringIO()
+        node.render_into(out.write)
+        self.assertEqual(out.getvalue(), node.to_html())
+
+    def test_render_into_raises_for_invalid_child(self):
+        node = ParentNode("div", [ParentNode("p", [])])
+        with self.assertRaises(ValueError):
+            node.render_into([].append)
+
 
 class TestTextNodeToHTML(unittest.TestCase):
     def test_text_node_to_html(self):
@@ -802,6 +864,66 @@ class TestTextToTextNodes(unittest.TestCase):
         self.assertEqual(nodes, expected)
 
 
+class TestSinglePassInline(unittest.TestCase):
+    def assertMatchesLegacy(self, text):
+        self.assertEqual(
+            text_to_textnodes(text, legacy=False), text_to_textnodes_legacy(text)
+        )
+
+    def test_matches_legacy_pipeline(self):
+        for text in [
+            "",
+            "plain",
+            "**bold**`code`",
+            "`code`**bold**",
+            "_a_**b**`c`![d](/e.png)[f](/g)",
+            "[f](/g)![d](/e.png)_a_**b**`c` tail",
+            "![a](/b.png)![c](/d.png)[e](/f)[g](/h)",
+            "!not an image [not a link] ***x*** *",
+            "a ![img_a_b](/a.png) b",
+            "[x ![img](/a.png)",
+            "****``__",
+            "[a] " * 50,
+            "x [a](b " * 50,
+            "[a](" * 50 + "b)",
+            "[a [b](/c) d](/e)",
+        ]:
+            with self.subTest(text=text):
+                self.assertMatchesLegacy(text)
+
+    def test_brackets_and_parentheses_do_not_nest(self):
+        self.assertEqual(
+            text_to_textnodes("[a [b](/c)"),
+            [TextNode("[a ", TextType.TEXT), TextNode("b", TextType.LINK, url="/c")],
+        )
+
+    def test_markup_inside_code_is_literal(self):
+        nodes = text_to_textnodes("`[a](/b) **c**`")
+        self.assertEqual(
+            nodes,
+            [TextNode("", TextType.TEXT), TextNode("[a](/b) **c**", TextType.CODE)],
+        )
+
+    def test_unclosed_delimiter_raises(self):
+        with self.assertRaises(ValueError):
+            text_to_textnodes("an **unclosed span", legacy=False)
+
+    def test_legacy_flag(self):
+        with mock.patch("functions.text_to_textnodes_legacy") as legacy:
+            text_to_textnodes("`[a](/b)`", legacy=True)
+        legacy.assert_called_once_with("`[a](/b)`")
+
+    def test_legacy_leaves_code_spans_alone(self):
+        nodes = text_to_textnodes("`[a](/b)`", legacy=True)
+        self.assertEqual(nodes, text_to_textnodes("`[a](/b)`", legacy=False))
+
+    def test_plain_text_skips_tokenizing(self):
+        with mock.patch("functions.scan_text_nodes") as scan:
+            nodes = text_to_textnodes("just plain prose, nothing else.")
+        scan.assert_not_called()
+        self.assertEqual(nodes, [TextNode("just plain prose, nothing else.", TextType.TEXT)])
+
+
 class TestMarkdownToBlocks(unittest.TestCase):
     def test_markdown_to_blocks(self):
         markdown = """
@@ -896,6 +1018,56 @@ Final paragraph.
         self.assertEqual(blocks, expected)
 
 
+class TestIterMarkdownBlocks(unittest.TestCase):
+    def test_matches_markdown_to_blocks(self):
+        markdown = "# Title\n\n\n\npara\nline  \n\n- a\n- b\n \nx\n\n\n"
+        lines = io.StringIO(markdown)
+        self.assertEqual(list(iter_markdown_blocks(lines)), markdown_to_blocks(markdown))
+
+    def test_yields_before_input_is_exhausted(self):
+        lines = iter(["first\n", "\n", "second\n"])
+        blocks = iter_markdown_blocks(lines)
+        self.assertEqual(next(blocks), "first")
+        self.assertEqual(next(lines), "second\n")
+
+    def test_render_blocks_into_matches_tree(self):
+        markdown = "# Title\n\nSome **bold** text\n\n- one\n- two"
+        out = []
+        render_blocks_into(iter_block_spans(io.StringIO(markdown)), out.append)
+        self.assertEqual("".join(out), markdown_to_html_node(markdown).to_html())
+
+
+    def test_crlf_line_endings(self):
+        markdown = "# Title\r\n\r\npara\r\nline\r\n\r\n- a\r\n- b\r\n"
+        self.assertEqual(markdown_to_blocks(markdown), ["# Title", "para\nline", "- a\n- b"])
+
+    def test_whitespace_only_lines_separate_blocks(self):
+        markdown = "first\n   \nsecond\n\t\nthird"
+        self.assertEqual(markdown_to_blocks(markdown), ["first", "second", "third"])
+
+    def test_fenced_code_keeps_blank_lines(self):
+        markdown = "para\n\n```\ndef f():\n\n    return 1\n```\n\nafter"
+        self.assertEqual(
+            markdown_to_blocks(markdown),
+            ["para", "```\ndef f():\n\n    return 1\n```", "after"],
+        )
+
+    def test_one_line_fence_does_not_open_code_block(self):
+        markdown = "```inline```\n\nafter"
+        self.assertEqual(markdown_to_blocks(markdown), ["```inline```", "after"])
+
+    def test_spans_report_first_line(self):
+        markdown = "\n# Title\n\n\npara\nline\n\n```\na\n\nb\n```"
+        self.assertEqual(
+            [line for line, _ in iter_block_spans(markdown.split("\n"))], [2, 5, 8]
+        )
+
+    def test_render_error_reports_line(self):
+        with self.assertRaises(ValueError) as context:
+            markdown_to_html_node("# Title\n\nok\n\nsome **unclosed bold")
+        self.assertIn("line 5", str(context.exception))
+
+
 class TestBlockToBlockTypes(unittest.TestCase):
     def test_unordered_list_block_to_block_type(self):
         block = "- This is a list\n- with a few\n- items"
@@ -964,6 +1136,29 @@ class TestBlockToBlockTypes(unittest.TestCase):
         self.assertEqual(block_type, BlockType.HEADING)
 
 
+    def test_malformed_blocks_are_paragraphs(self):
+        for block in [
+            "> quote\nnot a quote",
+            "- item\nnot an item",
+            "1. one\n3. three",
+            "1. one\ntwo",
+            "1",
+            "####### seven",
+            "#no space",
+            "# heading\nsecond line",
+            "```unclosed",
+        ]:
+            self.assertEqual(block_to_blocktype(block), BlockType.PARAGRAPH, block)
+
+    def test_long_ordered_list_block_to_block_type(self):
+        block = "\n".join(f"{n}. item" for n in range(1, 13))
+        self.assertEqual(block_to_blocktype(block), BlockType.ORDERED_LIST)
+
+    def test_malformed_list_is_rendered_as_paragraph(self):
+        html = markdown_to_html_node("- item\nnot an item").to_html()
+        self.assertEqual(html, "<div><p>- item not an item</p></div>")
+
+
 class TestMarkdownToHtmlNode(unittest.TestCase):
     def test_paragraphs(self):
         md = """
@@ -1168,5 +1363,1258 @@ This is a paragraph without a title.
 """
         self.assertRaises(Exception, extract_title, md)
 
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def read_file(path):
+    with open(path, "r") as f:
+        return f.read()
+
+
+def capture_log(func, *args, **kwargs):
+    records = []
+    handler = logging.Handler(logging.DEBUG)
+    handler.emit = records.append
+    level = logger.level
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    try:
+        func(*args, **kwargs)
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(level)
+    return [record.getMessage() for record in records]
+
+
+class TestTemplate(unittest.TestCase):
+    def test_render_fills_slots(self):
+        template = Template("<title>{{ Title }}</title><p>{{ Content }}</p>")
+        self.assertEqual(
+            template.render({"Title": "Hi", "Content": "Body"}),
+            "<title>Hi</title><p>Body</p>",
+        )
+
+    def test_compiled_parts(self):
+        template = Template("a{{ Title }}b{{ Content }}c")
+        self.assertEqual(template.parts, ["a", "{{ Title }}", "b", "{{ Content }}", "c"])
+        self.assertEqual(template.slots, [(1, "Title"), (3, "Content")])
+
+    def test_unfilled_slot_is_kept(self):
+        template = Template("{{ Title }} {{ Other }}")
+        self.assertEqual(template.render({"Title": "Hi"}), "Hi {{ Other }}")
+
+    def test_basepath_rewrites_static_parts(self):
+        template = Template('<link href="/index.css"><img src="/a.png">', "/site/")
+        self.assertEqual(
+            template.render({}), '<link href="/site/index.css"><img src="/site/a.png">'
+        )
+
+    def test_render_into_calls_callable_values(self):
+        template = Template("<p>{{ Content }}</p>")
+        node = ParentNode("b", [LeafNode(None, "x")])
+        out = []
+        template.render_into(out.append, {"Content": node.render_into})
+        self.assertEqual(out, ["<p>", "<b>", "x", "</b>", "</p>"])
+
+    def test_basepath_does_not_rewrite_content(self):
+        template = Template("{{ Content }}", "/site/")
+        content = '<code>href="/x"</code>'
+        self.assertEqual(template.render({"Content": content}), content)
+
+
+class TestBasepath(unittest.TestCase):
+    def test_links_and_images_are_rewritten(self):
+        md = "[post](/blog/post) ![img](/images/a.png) [out](https://boot.dev)"
+        html = markdown_to_html_node(md, "/site/").to_html()
+        self.assertEqual(
+            html,
+            '<div><p><a href="/site/blog/post">post</a> '
+            '<img src="/site/images/a.png" alt="img"> '
+            '<a href="https://boot.dev">out</a></p></div>',
+        )
+
+    def test_code_blocks_are_not_rewritten(self):
+        md = '```\n<a href="/x">x</a>\n```'
+        html = markdown_to_html_node(md, "/site/").to_html()
+        self.assertIn('href="/x"', html)
+
+
+class SiteTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        self.content = os.path.join(self.root, "content")
+        self.static = os.path.join(self.root, "static")
+        self.dest = os.path.join(self.root, "docs")
+        self.template = os.path.join(self.root, "template.html")
+        write_file(
+            self.template,
+            '<title>{{ Title }}</title><link href="/index.css"><main>{{ Content }}</main>',
+        )
+        write_file(os.path.join(self.content, "index.md"), "# Home\n\n[Post](/blog/post)")
+        write_file(
+            os.path.join(self.content, "blog", "post", "index.md"), "# Post\n\nSome **text**"
+        )
+        write_file(os.path.join(self.static, "index.css"), "body {}")
+        write_file(os.path.join(self.static, "images", "a.png"), "png")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+class TestCollectPages(SiteTestCase):
+    def test_collect_pages_sorted_pairs(self):
+        pages = collect_pages(self.content, self.dest)
+        self.assertEqual(
+            pages,
+            [
+                (
+                    os.path.join(self.content, "blog", "post", "index.md"),
+                    os.path.join(self.dest, "blog", "post", "index.html"),
+                ),
+                (
+                    os.path.join(self.content, "index.md"),
+                    os.path.join(self.dest, "index.html"),
+                ),
+            ],
+        )
+
+
+class TestCopyDirectoryContents(SiteTestCase):
+    def sync(self, keep=frozenset()):
+        return "\n".join(capture_log(copy_directory_contents, self.static, self.dest, keep))
+
+    def test_copies_tree(self):
+        self.sync()
+        self.assertEqual(read_file(os.path.join(self.dest, "index.css")), "body {}")
+        self.assertEqual(read_file(os.path.join(self.dest, "images", "a.png")), "png")
+
+    def test_unchanged_files_are_skipped(self):
+        self.sync()
+        self.assertEqual(self.sync(), "")
+
+    def test_changed_file_is_replaced(self):
+        self.sync()
+        # Save by rename, as most editors do, so the file gets a new inode
+        write_file(os.path.join(self.root, "new.css"), "body { margin: 0 }")
+        os.replace(
+            os.path.join(self.root, "new.css"), os.path.join(self.static, "index.css")
+        )
+        self.assertIn("index.css", self.sync())
+        self.assertEqual(
+            read_file(os.path.join(self.dest, "index.css")), "body { margin: 0 }"
+        )
+
+    def test_orphans_are_removed_but_kept_files_stay(self):
+        page = os.path.join(self.dest, "blog", "index.html")
+        write_file(page, "<p>page</p>")
+        write_file(os.path.join(self.dest, "images", "old.png"), "old")
+        write_file(os.path.join(self.dest, "stale", "x.html"), "x")
+        self.sync(keep={os.path.normpath(page)})
+        self.assertTrue(os.path.exists(page))
+        self.assertFalse(os.path.exists(os.path.join(self.dest, "images", "old.png")))
+        self.assertFalse(os.path.exists(os.path.join(self.dest, "stale")))
+
+    def test_sync_file_prefers_hardlink(self):
+        src_path = os.path.join(self.static, "index.css")
+        dest_path = os.path.join(self.root, "linked.css")
+        self.assertTrue(sync_file(src_path, dest_path))
+        self.assertTrue(os.path.samefile(src_path, dest_path))
+        self.assertFalse(sync_file(src_path, dest_path))
+
+    def test_page_over_a_linked_static_file_leaves_the_source_alone(self):
+        static_page = os.path.join(self.static, "about.html")
+        write_file(static_page, "<p>static</p>")
+        write_file(os.path.join(self.content, "about.md"), "# About")
+        manifest = os.path.join(self.root, ".ssg-cache", "manifest.json")
+        capture_log(
+            build_incremental, self.content, self.template, self.static, self.dest, "/", manifest
+        )
+        self.assertIn("<h1>About</h1>", read_file(os.path.join(self.dest, "about.html")))
+        self.assertEqual(read_file(static_page), "<p>static</p>")
+
+        for options in [{"io_concurrency": 2}, {"jobs": 2}, {"profile": BuildProfile()}]:
+            self.sync()
+            capture_log(
+                generate_pages_recursive, self.content, self.template, self.dest, "/", **options
+            )
+            self.assertEqual(read_file(static_page), "<p>static</p>")
+            self.assertNotIn("about.html.tmp", os.listdir(self.dest))
+
+
+class TestParallelBuild(SiteTestCase):
+    def build(self, dest, jobs):
+        messages = capture_log(generate_pages_recursive, self.content, self.template, dest, "/", jobs=jobs)
+        return "\n".join(message for message in messages if message.startswith("Generating page"))
+
+    def test_parallel_output_matches_serial(self):
+        serial_dest = os.path.join(self.root, "serial")
+        parallel_dest = os.path.join(self.root, "parallel")
+        self.build(serial_dest, 1)
+        self.build(parallel_dest, 2)
+        for _, dest_path in collect_pages(self.content, serial_dest):
+            rel_path = os.path.relpath(dest_path, serial_dest)
+            self.assertEqual(
+                read_file(dest_path), read_file(os.path.join(parallel_dest, rel_path))
+            )
+
+    def test_parallel_report_is_in_page_order(self):
+        report = self.build(self.dest, 2).splitlines()
+        self.assertEqual(len(report), 2)
+        self.assertIn(os.path.join("blog", "post", "index.md"), report[0])
+        self.assertIn(os.path.join(self.content, "index.md"), report[1])
+
+
+class TestAsyncPipeline(SiteTestCase):
+    def build(self, dest, io_concurrency=0):
+        generate_pages_recursive(self.content, self.template, dest, "/", io_concurrency=io_concurrency)
+        return {
+            os.path.relpath(dest_path, dest): read_file(dest_path)
+            for _, dest_path in collect_pages(self.content, dest)
+        }
+
+    def test_output_matches_serial(self):
+        serial = self.build(os.path.join(self.root, "serial"))
+        self.assertEqual(self.build(self.dest, io_concurrency=4), serial)
+
+    def test_large_pages_are_streamed(self):
+        serial = self.build(os.path.join(self.root, "serial"))
+        with mock.patch("functions.STREAM_THRESHOLD", 0):
+            with mock.patch("functions.read_text") as read:
+                self.assertEqual(self.build(self.dest, io_concurrency=2), serial)
+        read.assert_not_called()
+
+    def test_in_flight_pages_are_bounded(self):
+        for n in range(10):
+            write_file(os.path.join(self.content, f"page{n}", "index.md"), f"# Page {n}")
+        in_flight = []
+        active = [0]
+        write_text = functions.write_text
+
+        def slow_write(path, text):
+            active[0] += 1
+            in_flight.append(active[0])
+            time.sleep(0.01)
+            active[0] -= 1
+            return write_text(path, text)
+
+        with mock.patch("functions.write_text", slow_write):
+            self.build(self.dest, io_concurrency=3)
+        self.assertEqual(len(in_flight), 12)
+        self.assertLessEqual(max(in_flight), 3)
+
+    def test_missing_source_raises(self):
+        pages = [(os.path.join(self.content, "missing.md"), os.path.join(self.dest, "missing.html"))]
+        with self.assertRaises(FileNotFoundError):
+            generate_pages(pages, self.template, "/", io_concurrency=2)
+
+
+class TestStreamingPage(SiteTestCase):
+    def test_streamed_page_matches_buffered_page(self):
+        write_file(
+            os.path.join(self.content, "long.md"),
+            "intro\n\n# Long\n\n" + "\n\n".join(f"para _{n}_" for n in range(200)),
+        )
+        outputs = []
+        for stream in [False, True]:
+            dest_path = os.path.join(self.dest, f"{stream}.html")
+            with redirect_stdout(io.StringIO()):
+                generate_page(
+                    os.path.join(self.content, "long.md"),
+                    self.template,
+                    dest_path,
+                    "/",
+                    stream=stream,
+                )
+            outputs.append(read_file(dest_path))
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertIn("<title>Long</title>", outputs[1])
+
+
+class TestRenderCache(SiteTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = RenderCache(os.path.join(self.root, ".ssg-cache"), 1024)
+
+    def generate(self, basepath="/"):
+        with redirect_stdout(io.StringIO()):
+            generate_page(
+                os.path.join(self.content, "index.md"),
+                self.template,
+                os.path.join(self.dest, "index.html"),
+                basepath,
+                cache=self.cache,
+            )
+        return read_file(os.path.join(self.dest, "index.html"))
+
+    def test_get_and_put(self):
+        self.assertIsNone(self.cache.get("abcd"))
+        self.cache.put("abcd", "<p>x</p>")
+        self.assertEqual(self.cache.get("abcd"), "<p>x</p>")
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_hit_skips_parsing(self):
+        first = self.generate()
+        with mock.patch("functions.markdown_to_html_node") as parse:
+            second = self.generate()
+        parse.assert_not_called()
+        self.assertEqual(first, second)
+
+    def test_basepath_is_part_of_the_key(self):
+        self.generate()
+        self.assertIn('href="/site/blog/post"', self.generate("/site/"))
+
+    def test_trim_evicts_least_recently_used(self):
+        for n, key in enumerate(["aa01", "aa02", "aa03"]):
+            self.cache.put(key, "x" * 400)
+            os.utime(self.cache.path(key), ns=(n * 10**9, n * 10**9))
+        self.cache.trim()
+        self.assertFalse(os.path.exists(self.cache.path("aa01")))
+        self.assertEqual(self.cache.get("aa03"), "x" * 400)
+
+    def test_trim_ignores_entries_removed_meanwhile(self):
+        self.cache.put("aa01", "x" * 2000)
+        with mock.patch("cache.os.remove", side_effect=FileNotFoundError):
+            self.cache.trim()
+
+    def test_builds_report_counts(self):
+        for jobs in [1, 2]:
+            with self.subTest(jobs=jobs):
+                cache = RenderCache(os.path.join(self.root, f"pages{jobs}"), 1 << 20)
+                build = lambda: capture_log(
+                    generate_pages_recursive,
+                    self.content, self.template, self.dest, "/", jobs=jobs, cache=cache
+                )
+                self.assertIn("Page cache: 0 hits, 2 misses", build())
+                self.assertIn("Page cache: 2 hits, 0 misses", build())
+
+    def test_watch_rebuilds_trim_the_cache(self):
+        capture_log(generate_pages_recursive, self.content, self.template, self.dest, "/")
+        watcher = SiteWatcher(self.content, self.template, self.static, self.dest, "/", self.cache)
+        write_file(os.path.join(self.content, "index.md"), "# Home\n\nAn edit")
+        with mock.patch.object(self.cache, "trim") as trim:
+            capture_log(watcher.poll)
+            trim.assert_called_once_with()
+            capture_log(watcher.poll)
+            trim.assert_called_once_with()
+
+
+class TestBlockCache(SiteTestCase):
+    MARKDOWN = "# Title\n\nSame **paragraph**\n\n- a\n- b\n\nSame **paragraph**"
+
+    def test_output_matches_uncached(self):
+        cache = BlockCache(1024)
+        expected = markdown_to_html_node(self.MARKDOWN).to_html()
+        self.assertEqual(markdown_to_html_node(self.MARKDOWN, "/", cache).to_html(), expected)
+        self.assertEqual(markdown_to_html_node(self.MARKDOWN, "/", cache).to_html(), expected)
+
+    def test_repeated_blocks_are_rendered_once(self):
+        cache = BlockCache(1024)
+        markdown_to_html_node(self.MARKDOWN, "/", cache)
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+        markdown_to_html_node(self.MARKDOWN, "/", cache)
+        self.assertEqual((cache.hits, cache.misses), (5, 3))
+
+    def test_basepath_is_part_of_the_key(self):
+        cache = BlockCache(1024)
+        markdown_to_html_node("[Post](/blog/post)", "/", cache)
+        html = markdown_to_html_node("[Post](/blog/post)", "/site/", cache).to_html()
+        self.assertIn('href="/site/blog/post"', html)
+
+    def test_evicts_least_recently_used(self):
+        cache = BlockCache(30)
+        cache.put("a", "x" * 10)
+        cache.put("b", "x" * 10)
+        cache.get("a")
+        cache.put("c", "x" * 10)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "x" * 10)
+        self.assertLessEqual(cache.size, 30)
+
+    def test_oversized_entry_is_not_stored(self):
+        cache = BlockCache(10)
+        cache.put("a", "x" * 20)
+        self.assertEqual((len(cache.entries), cache.size), (0, 0))
+
+    def test_streaming_uses_cache(self):
+        cache = BlockCache(1024)
+        out = []
+        render_blocks_into(iter_block_spans(self.MARKDOWN.split("\n")), out.append, "/", cache)
+        self.assertEqual("".join(out), markdown_to_html_node(self.MARKDOWN).to_html())
+        self.assertEqual(cache.hits, 1)
+
+    def test_parallel_build_reports_counts(self):
+        messages = capture_log(
+            generate_pages_recursive,
+            self.content, self.template, self.dest, "/", jobs=2, block_cache=BlockCache(1024)
+        )
+        self.assertIn("Block cache: 0 hits, 4 misses", messages)
+
+
+class TestProfile(SiteTestCase):
+    def build(self, jobs=1):
+        profile = BuildProfile()
+        with redirect_stdout(io.StringIO()):
+            generate_pages_recursive(self.content, self.template, self.dest, "/", jobs=jobs, profile=profile)
+        return profile
+
+    def test_nested_time_is_charged_once(self):
+        timer = StageTimer()
+        timer.call("tree build", lambda: timer.call("inline", lambda: None))
+        self.assertGreater(timer.stages["inline"], 0)
+        self.assertGreater(timer.stages["tree build"], 0)
+        self.assertEqual(set(timer.stages), set(PAGE_STAGES))
+
+    def test_profiled_output_matches_normal_build(self):
+        with redirect_stdout(io.StringIO()):
+            generate_pages_recursive(self.content, self.template, self.dest, "/")
+        expected = read_file(os.path.join(self.dest, "index.html"))
+        self.build()
+        self.assertEqual(read_file(os.path.join(self.dest, "index.html")), expected)
+
+    def test_records_every_page(self):
+        for jobs in (1, 2):
+            profile = self.build(jobs)
+            self.assertEqual(len(profile.pages), 2)
+            report = profile.to_json(1)
+            self.assertEqual(report["pages"], 2)
+            self.assertEqual(len(report["slowest"]), 1)
+            self.assertEqual(set(report["stages"]), set(PAGE_STAGES))
+
+    def test_table_lists_stages_and_slowest_pages(self):
+        profile = self.build()
+        profile.add_stage("static copy", 0.001)
+        table = profile.format_table(1)
+        self.assertIn("static copy", table)
+        self.assertIn("Slowest 1 of 2 pages:", table)
+
+
+class TestLogging(SiteTestCase):
+    def tearDown(self):
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            handler.close()
+        logger.setLevel(logging.NOTSET)
+        logger.propagate = True
+        super().tearDown()
+
+    def build(self, level, json_path=None):
+        out = io.StringIO()
+        with redirect_stdout(out):
+            configure_logging(level, json_path)
+            generate_pages_recursive(self.content, self.template, self.dest, "/")
+        return out.getvalue()
+
+    def test_default_level_reports_summary_only(self):
+        output = self.build(logging.INFO)
+        self.assertNotIn("Generating page", output)
+        self.assertIn("Generated 2 pages in", output)
+
+    def test_verbose_reports_every_page(self):
+        self.assertEqual(self.build(logging.DEBUG).count("Generating page"), 2)
+
+    def test_quiet_reports_nothing(self):
+        self.assertEqual(self.build(logging.WARNING), "")
+
+    def test_json_lines_stream_has_every_event(self):
+        json_path = os.path.join(self.root, "events.jsonl")
+        output = self.build(logging.WARNING, json_path)
+        self.assertEqual(output, "")
+        events = [json.loads(line) for line in read_file(json_path).splitlines()]
+        pages = [event for event in events if event["event"] == "page"]
+        self.assertEqual(len(pages), 2)
+        self.assertEqual(pages[0]["dest"], os.path.join(self.dest, "blog", "post", "index.html"))
+        self.assertEqual(events[-1]["event"], "done")
+        self.assertEqual(events[-1]["pages"], 2)
+        self.assertGreater(events[-1]["bytes"], 0)
+
+    def test_progress_counts_pages_and_bytes(self):
+        progress = Progress(3, interval=0)
+        messages = capture_log(progress.update, 1500000)
+        self.assertEqual(len(messages), 1)
+        self.assertIn("Generated 1/3 pages", messages[0])
+        self.assertIn("1.5 MB written", messages[0])
+
+
+class TestIncrementalBuild(SiteTestCase):
+    def build(self, basepath="/", explain=False):
+        self.manifest = os.path.join(self.root, ".ssg-cache", "manifest.json")
+        generated = []
+        self.out = "\n".join(capture_log(
+            lambda: generated.extend(build_incremental(
+                self.content, self.template, self.static, self.dest, basepath, self.manifest,
+                explain=explain,
+            ))
+        ))
+        return generated
+
+    def test_first_build_generates_everything(self):
+        generated = self.build()
+        self.assertEqual(len(generated), 2)
+        self.assertTrue(os.path.exists(os.path.join(self.dest, "images", "a.png")))
+        self.assertIn(
+            "<b>text</b>", read_file(os.path.join(self.dest, "blog", "post", "index.html"))
+        )
+
+    def test_unchanged_build_generates_nothing(self):
+        self.build()
+        self.assertEqual(self.build(), [])
+
+    def test_only_changed_page_is_regenerated(self):
+        self.build()
+        write_file(os.path.join(self.content, "index.md"), "# Home\n\nEdited")
+        self.assertEqual(self.build(), [os.path.join(self.dest, "index.html")])
+        self.assertIn("Edited", read_file(os.path.join(self.dest, "index.html")))
+
+    def test_template_change_rebuilds_every_page(self):
+        self.build()
+        write_file(self.template, "<h1>{{ Title }}</h1>{{ Content }}")
+        self.assertEqual(len(self.build()), 2)
+
+    def test_basepath_change_rebuilds_every_page(self):
+        self.build()
+        self.assertEqual(len(self.build("/site/")), 2)
+
+    def test_missing_output_is_regenerated(self):
+        self.build()
+        os.remove(os.path.join(self.dest, "index.html"))
+        self.assertEqual(self.build(), [os.path.join(self.dest, "index.html")])
+
+    def test_deleted_sources_remove_outputs(self):
+        self.build()
+        os.remove(os.path.join(self.content, "blog", "post", "index.md"))
+        os.remove(os.path.join(self.static, "images", "a.png"))
+        self.build()
+        self.assertFalse(os.path.exists(os.path.join(self.dest, "blog")))
+        self.assertFalse(os.path.exists(os.path.join(self.dest, "images")))
+        self.assertTrue(os.path.exists(os.path.join(self.dest, "index.html")))
+
+    def test_changed_static_file_is_copied(self):
+        self.build()
+        write_file(os.path.join(self.static, "index.css"), "body { margin: 0 }")
+        self.build()
+        self.assertEqual(
+            read_file(os.path.join(self.dest, "index.css")), "body { margin: 0 }"
+        )
+
+
+    def test_changed_image_rebuilds_only_pages_using_it(self):
+        write_file(os.path.join(self.content, "index.md"), "# Home\n\n![a](/images/a.png)")
+        self.build()
+        write_file(os.path.join(self.static, "images", "a.png"), "new png")
+        self.assertEqual(self.build(), [os.path.join(self.dest, "index.html")])
+
+    def test_new_linked_page_rebuilds_linking_page(self):
+        write_file(os.path.join(self.content, "index.md"), "# Home\n\n[About](/about)")
+        self.build()
+        write_file(os.path.join(self.content, "about", "index.md"), "# About")
+        generated = self.build(explain=True)
+        self.assertEqual(
+            sorted(generated),
+            [os.path.join(self.dest, "about", "index.html"), os.path.join(self.dest, "index.html")],
+        )
+        self.assertIn(
+            f"Rebuilding {os.path.join(self.content, 'index.md')}: link added: "
+            + os.path.join(self.content, "about", "index.md"),
+            self.out,
+        )
+
+    def test_edited_linked_page_does_not_rebuild_linking_page(self):
+        self.build()
+        write_file(os.path.join(self.content, "blog", "post", "index.md"), "# Post\n\nEdited")
+        self.assertEqual(self.build(), [os.path.join(self.dest, "blog", "post", "index.html")])
+
+    def test_explain_lists_reasons(self):
+        self.build()
+        write_file(self.template, "<h1>{{ Title }}</h1>{{ Content }}")
+        self.build(explain=True)
+        self.assertEqual(self.out.count(f"template changed: {os.path.normpath(self.template)}"), 2)
+
+    def test_reasons_are_events_that_explain_shows(self):
+        self.build()
+        for explain, level, heading in [(False, logging.DEBUG, "h1"), (True, logging.INFO, "h2")]:
+            write_file(self.template, f"<{heading}>{{{{ Title }}}}</{heading}>{{{{ Content }}}}")
+            with self.assertLogs(logger, logging.DEBUG) as logs:
+                build_incremental(
+                    self.content, self.template, self.static, self.dest, "/", self.manifest,
+                    explain=explain,
+                )
+            events = [record for record in logs.records if record.event == "rebuild_reason"]
+            self.assertEqual([record.levelno for record in events], [level, level])
+            self.assertEqual(
+                events[0].data["reasons"], [f"template changed: {os.path.normpath(self.template)}"]
+            )
+
+    def test_manifest_records_dependencies(self):
+        self.build()
+        deps = load_manifest(self.manifest)["pages"][os.path.join(self.content, "index.md")]["deps"]
+        self.assertEqual(deps["links"], [os.path.join(self.content, "blog", "post", "index.md")])
+
+
+class TestDependencyGraph(unittest.TestCase):
+    def test_page_dependencies(self):
+        deps = page_dependencies(
+            "# T\n\n![a](/images/a.png) ![b](https://x.com/b.png)\n\n"
+            "[p](/blog/post#top) [c](/docs/c.pdf) [h](/old.html) [e](https://x.com)",
+            "template.html",
+            "content",
+            "static",
+        )
+        self.assertEqual(deps["template"], "template.html")
+        self.assertEqual(
+            deps["assets"],
+            [os.path.join("static", "docs", "c.pdf"), os.path.join("static", "images", "a.png")],
+        )
+        self.assertEqual(
+            deps["links"],
+            [os.path.join("content", "blog", "post", "index.md"), os.path.join("content", "old.md")],
+        )
+
+    def test_rebuild_reasons(self):
+        graph = DependencyGraph(
+            {
+                "a.md": {"template": "t.html", "assets": ["x.png"], "links": ["b.md"]},
+                "b.md": {"template": "t.html", "assets": [], "links": []},
+            }
+        )
+        self.assertEqual(graph.rebuild_reasons({"x.png": "changed"}), {"a.md": ["asset changed: x.png"]})
+        self.assertEqual(graph.rebuild_reasons({"b.md": "changed"}), {"b.md": ["source changed"]})
+        self.assertEqual(
+            graph.rebuild_reasons({"b.md": "removed"}),
+            {"b.md": ["source removed"], "a.md": ["link removed: b.md"]},
+        )
+        self.assertEqual(set(graph.rebuild_reasons({"t.html": "changed"})), {"a.md", "b.md"})
+
+
+class TestShards(SiteTestCase):
+    def setUp(self):
+        super().setUp()
+        for n in range(8):
+            write_file(os.path.join(self.content, f"page{n}", "index.md"), f"# Page {n}")
+        self.shards = os.path.join(self.root, "shards")
+
+    def build_shards(self, count, indexes=None):
+        for index in indexes or range(1, count + 1):
+            build_shard(self.content, self.template, self.shards, "/", index, count)
+
+    def merge(self, verify_only=False):
+        return merge_shards(self.shards, self.content, self.static, self.dest, verify_only)
+
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard("2/4"), (2, 4))
+        for value in ["0/4", "5/4", "a/b", "3"]:
+            self.assertRaises(ValueError, parse_shard, value)
+
+    def test_partition_is_stable(self):
+        self.assertEqual(shard_of("blog/post/index.md", 4), shard_of("blog/post/index.md", 4))
+        shards = {shard_of(f"page{n}/index.md", 3) for n in range(50)}
+        self.assertEqual(shards, {1, 2, 3})
+
+    def test_merged_shards_match_full_build(self):
+        full = os.path.join(self.root, "full")
+        generate_pages_recursive(self.content, self.template, full, "/")
+        self.build_shards(3)
+        merged = self.merge()
+        self.assertEqual(len(merged), 10)
+        for _, dest_path in collect_pages(self.content, full):
+            rel_path = os.path.relpath(dest_path, full)
+            self.assertEqual(read_file(os.path.join(self.dest, rel_path)), read_file(dest_path))
+        self.assertEqual(read_file(os.path.join(self.dest, "index.css")), "body {}")
+
+    def test_shards_are_disjoint_and_complete(self):
+        self.build_shards(3)
+        pages = [set(manifest["pages"]) for manifest in load_shard_manifests(self.shards)]
+        self.assertEqual(sum(len(shard) for shard in pages), 10)
+        self.assertEqual(len(set().union(*pages)), 10)
+
+    def test_missing_shard_fails_verification(self):
+        self.build_shards(3, [1, 3])
+        with self.assertRaises(ValueError) as context:
+            self.merge(verify_only=True)
+        self.assertIn("missing shards: 2", str(context.exception))
+        self.assertFalse(os.path.exists(self.dest))
+
+    def test_new_page_after_sharding_fails_verification(self):
+        self.build_shards(2)
+        write_file(os.path.join(self.content, "late", "index.md"), "# Late")
+        with self.assertRaises(ValueError) as context:
+            self.merge()
+        self.assertIn("late/index.md is in no shard", str(context.exception))
+
+    def test_edited_page_after_sharding_fails_verification(self):
+        self.build_shards(2)
+        write_file(os.path.join(self.content, "page3", "index.md"), "# Page 3, edited")
+        with self.assertRaises(ValueError) as context:
+            self.merge(verify_only=True)
+        self.assertIn("shard 1 was built from different content", str(context.exception))
+
+    def test_overlapping_shards_fail_verification(self):
+        self.build_shards(2)
+        manifests = load_shard_manifests(self.shards)
+        manifests[1]["pages"].update(manifests[0]["pages"])
+        rel_sources = list(manifests[0]["pages"]) + list(manifests[1]["pages"])
+        problems = verify_shards(manifests, rel_sources, manifests[0]["content"])
+        self.assertTrue(any("is in shards 1 and 2" in problem for problem in problems))
+
+
+class TestCompress(SiteTestCase):
+    def setUp(self):
+        super().setUp()
+        self.gzip_cache = os.path.join(self.root, "gzip")
+        generate_pages_recursive(self.content, self.template, self.dest, "/")
+        self.big = os.path.join(self.dest, "big.css")
+        write_file(self.big, "body { color: red }\n" * 100)
+
+    def compress(self):
+        return capture_log(compress_outputs, self.dest, self.gzip_cache, 1024, 2)
+
+    def test_sidecar_matches_original(self):
+        self.compress()
+        with gzip.open(self.big + ".gz", "rt") as f:
+            self.assertEqual(f.read(), read_file(self.big))
+
+    def test_small_and_binary_files_are_skipped(self):
+        write_file(os.path.join(self.dest, "big.png"), "x" * 2000)
+        self.assertEqual(compressible_files(self.dest, 1024), [self.big])
+        self.compress()
+        self.assertFalse(os.path.exists(os.path.join(self.dest, "index.html.gz")))
+
+    def test_unchanged_files_reuse_the_cache(self):
+        self.compress()
+        messages = self.compress()
+        self.assertIn("Compressed 1 files (1 reused)", messages[-1])
+
+    def test_stale_sidecars_and_cache_entries_are_removed(self):
+        self.compress()
+        static_gz = os.path.join(self.dest, "archive.json.gz")
+        write_file(static_gz, "not ours")
+        write_file(self.big, "tiny")
+        self.compress()
+        self.assertFalse(os.path.exists(self.big + ".gz"))
+        self.assertEqual(read_file(static_gz), "not ours")
+        cached = [name for _, _, names in os.walk(self.gzip_cache) for name in names]
+        self.assertEqual(cached, ["sidecars.json"])
+
+    def test_sidecars_are_removed_when_compression_is_off(self):
+        self.compress()
+        static_gz = os.path.join(self.dest, "archive.json.gz")
+        write_file(static_gz, "not ours")
+        capture_log(remove_sidecars, self.dest, self.gzip_cache)
+        self.assertFalse(os.path.exists(self.big + ".gz"))
+        self.assertEqual(read_file(static_gz), "not ours")
+        self.assertEqual(remove_sidecars(self.dest, self.gzip_cache), set())
+
+    def test_output_is_deterministic(self):
+        self.compress()
+        with open(self.big + ".gz", "rb") as f:
+            first = f.read()
+        os.remove(self.big + ".gz")
+        shutil.rmtree(self.gzip_cache)
+        self.compress()
+        with open(self.big + ".gz", "rb") as f:
+            self.assertEqual(f.read(), first)
+
+
+class TestSearchIndex(SiteTestCase):
+    def setUp(self):
+        super().setUp()
+        self.state = os.path.join(self.root, ".ssg-cache", "search.json")
+        self.manifest = os.path.join(self.root, ".ssg-cache", "manifest.json")
+
+    def search(self, term):
+        # Decodes the delta-encoded postings the way a client would
+        search_dir = os.path.join(self.dest, "search")
+        pages = json.loads(read_file(os.path.join(search_dir, "pages.json")))["pages"]
+        shard_path = os.path.join(search_dir, shard_key(term) + ".json")
+        if not os.path.exists(shard_path):
+            return {}
+        encoded = json.loads(read_file(shard_path)).get(term, [])
+        results = {}
+        page_id, i = 0, 0
+        while i < len(encoded):
+            page_id += encoded[i]
+            count = encoded[i + 1]
+            deltas = encoded[i + 2 : i + 2 + count]
+            results[pages[page_id][0]] = [sum(deltas[: n + 1]) for n in range(count)]
+            i += 2 + count
+        return results
+
+    def build(self, **options):
+        index = SearchIndex(self.dest)
+        capture_log(
+            generate_pages_recursive, self.content, self.template, self.dest, "/",
+            index=index, **options
+        )
+        capture_log(index.write, "/")
+        return index
+
+    def build_incremental(self):
+        index = SearchIndex.load(self.state, self.dest)
+        capture_log(
+            build_incremental, self.content, self.template, self.static, self.dest, "/",
+            self.manifest, index=index,
+        )
+        index.save(self.state)
+        capture_log(index.write, "/")
+        return index
+
+    def test_shard_key(self):
+        self.assertEqual(shard_key("glorfindel"), "gl")
+        self.assertEqual(shard_key("_x"), "x5f78")
+
+    def test_terms_and_positions(self):
+        self.build()
+        self.assertEqual(self.search("post"), {"/": [1], "/blog/post/": [0]})
+        self.assertEqual(self.search("text"), {"/blog/post/": [2]})
+        # Link targets are not text a reader can search for
+        self.assertEqual(self.search("blog"), {})
+
+    def test_markup_is_not_part_of_the_terms(self):
+        markdown = "An _italic_ **bold** `snake_case` [link](/target)\n\n- ![alt](/a.png) item\n\n```\ncode_block\n```"
+        expected = ["an", "italic", "bold", "snake_case", "link", "alt", "item", "code_block"]
+        for block_cache in [None, BlockCache(1 << 16)]:
+            with self.subTest(block_cache=block_cache):
+                page = PageTerms("Home")
+                markdown_to_html_node(markdown, "/", block_cache, collect_text=page.feed)
+                self.assertEqual(list(page.terms), expected)
+
+    def test_cached_pages_and_blocks_are_indexed_without_parsing(self):
+        cache = RenderCache(os.path.join(self.root, "pages"), 1 << 20)
+        block_cache = BlockCache(1 << 16)
+        self.build(cache=cache)
+        self.build(block_cache=block_cache)
+        with mock.patch("functions.text_to_textnodes") as parse:
+            self.build(cache=cache)
+            self.assertEqual(self.search("text"), {"/blog/post/": [2]})
+            self.build(block_cache=block_cache)
+            self.assertEqual(self.search("text"), {"/blog/post/": [2]})
+        parse.assert_not_called()
+
+    def test_page_cached_without_text_is_rendered_again(self):
+        cache = RenderCache(os.path.join(self.root, "pages"), 1 << 20)
+        capture_log(generate_pages_recursive, self.content, self.template, self.dest, "/", cache=cache)
+        self.build(cache=cache)
+        self.assertEqual(self.search("text"), {"/blog/post/": [2]})
+
+    def test_italic_word_is_found(self):
+        write_file(os.path.join(self.content, "index.md"), "# Home\n\nAn _italic_ word")
+        self.build()
+        self.assertEqual(self.search("italic"), {"/": [2]})
+
+    def test_other_build_modes_match_serial(self):
+        self.build()
+        serial = {term: self.search(term) for term in ["home", "post", "some", "text"]}
+        for options in [{"jobs": 2}, {"io_concurrency": 2}, {"profile": BuildProfile()}]:
+            shutil.rmtree(self.dest)
+            self.build(**options)
+            self.assertEqual({term: self.search(term) for term in serial}, serial)
+
+        index = SearchIndex(self.dest)
+        post = os.path.join(self.content, "blog", "post", "index.md")
+        dest = os.path.join(self.dest, "blog", "post", "index.html")
+        generate_page(post, self.template, dest, "/", quiet=True, stream=True, index=index)
+        self.assertEqual(index.entry("blog/post/index.html")["terms"]["text"], [2])
+
+    def test_incremental_build_updates_only_changed_pages(self):
+        self.build_incremental()
+        write_file(os.path.join(self.content, "index.md"), "# Home\n\nEdited words")
+        write_file(os.path.join(self.content, "new", "index.md"), "# New words")
+        self.build_incremental()
+        self.assertEqual(self.search("words"), {"/": [2], "/new/": [1]})
+        self.assertEqual(self.search("text"), {"/blog/post/": [2]})
+
+        os.remove(os.path.join(self.content, "new", "index.md"))
+        self.build_incremental()
+        self.assertEqual(self.search("words"), {"/": [2]})
+        self.assertNotIn("new/index.html", SearchIndex.load(self.state, self.dest).pages)
+
+    def test_pages_changed_while_indexing_was_off_are_reindexed(self):
+        self.build_incremental()
+        write_file(os.path.join(self.content, "index.md"), "# Home\n\nzebraword")
+        capture_log(
+            build_incremental, self.content, self.template, self.static, self.dest, "/",
+            self.manifest,
+        )
+        capture_log(remove_search_index, self.dest, self.state)
+        self.assertFalse(os.path.exists(os.path.join(self.dest, "search")))
+        self.assertFalse(os.path.exists(self.state))
+
+        self.build_incremental()
+        self.assertEqual(self.search("zebraword"), {"/": [1]})
+
+    def test_pages_missing_from_index_are_rebuilt(self):
+        capture_log(
+            build_incremental, self.content, self.template, self.static, self.dest, "/",
+            self.manifest,
+        )
+        index = self.build_incremental()
+        self.assertEqual(len(index.pages), 2)
+        self.assertEqual(self.search("text"), {"/blog/post/": [2]})
+
+    def test_unchanged_shards_are_not_rewritten(self):
+        self.build()
+        messages = capture_log(self.build().write, "/")
+        self.assertIn("(0 files written)", messages[-1])
+
+
+class TestFingerprint(SiteTestCase):
+    def setUp(self):
+        super().setUp()
+        self.manifest = os.path.join(self.root, ".ssg-cache", "manifest.json")
+        write_file(
+            os.path.join(self.content, "index.md"), "# Home\n\n![A](/images/a.png)"
+        )
+
+    def assets(self):
+        return asset_manifest(static_hashes(self.static))
+
+    def build(self, fingerprint_assets=True):
+        generated = []
+        self.out = "\n".join(capture_log(
+            lambda: generated.extend(build_incremental(
+                self.content, self.template, self.static, self.dest, "/", self.manifest,
+                explain=True, fingerprint_assets=fingerprint_assets,
+            ))
+        ))
+        return generated
+
+    def test_names_contain_the_content_hash(self):
+        css_hash = static_hashes(self.static)["index.css"]
+        self.assertEqual(self.assets().get("/index.css"), f"/index.{css_hash[:10]}.css")
+
+    def test_references_are_rewritten_with_the_basepath(self):
+        assets = AssetManifest({"/index.css": "/index.abc.css", "/a.png": "/a.abc.png"})
+        template = Template('<link href="/index.css"><a href="/about">', "/site/", assets)
+        self.assertEqual(
+            template.render({}), '<link href="/site/index.abc.css"><a href="/site/about">'
+        )
+        html = markdown_to_html_node("![a](/a.png) [b](/b)", "/site/", assets=assets).to_html()
+        self.assertEqual(
+            html, '<div><p><img src="/site/a.abc.png" alt="a"> <a href="/site/b">b</a></p></div>'
+        )
+
+    def test_assets_are_part_of_the_cache_key(self):
+        assets = self.assets()
+        self.assertNotEqual(render_cache_key("# A", "/"), render_cache_key("# A", "/", assets))
+
+    def test_publish_writes_manifest_and_removes_stale_copies(self):
+        assets = self.assets()
+        capture_log(publish_assets, self.static, self.dest, assets)
+        css = os.path.join(self.dest, *assets.get("/index.css")[1:].split("/"))
+        self.assertEqual(read_file(css), "body {}")
+        manifest = json.loads(read_file(os.path.join(self.dest, "assets.json")))
+        self.assertEqual(manifest["/images/a.png"], assets.get("/images/a.png"))
+
+        write_file(os.path.join(self.static, "index.css"), "body { margin: 0 }")
+        capture_log(publish_assets, self.static, self.dest, self.assets())
+        self.assertFalse(os.path.exists(css))
+
+    def test_incremental_build_links_fingerprinted_assets(self):
+        self.build()
+        assets = self.assets()
+        home = read_file(os.path.join(self.dest, "index.html"))
+        self.assertIn(f'href="{assets.get("/index.css")}"', home)
+        self.assertIn(f'src="{assets.get("/images/a.png")}"', home)
+        # The original names stay for references that are not rewritten
+        self.assertTrue(os.path.exists(os.path.join(self.dest, "index.css")))
+
+    def test_changed_template_asset_rebuilds_every_page(self):
+        self.build()
+        write_file(os.path.join(self.static, "index.css"), "body { margin: 0 }")
+        self.assertEqual(len(self.build()), 2)
+        self.assertIn("template asset changed:", self.out)
+        self.assertIn(
+            self.assets().get("/index.css"), read_file(os.path.join(self.dest, "index.html"))
+        )
+
+    def test_turning_fingerprinting_off_removes_published_copies(self):
+        self.build()
+        css = os.path.join(self.dest, *self.assets().get("/index.css")[1:].split("/"))
+        self.build(fingerprint_assets=False)
+        self.assertFalse(os.path.exists(css))
+        self.assertFalse(os.path.exists(os.path.join(self.dest, "assets.json")))
+        self.assertIn('href="/index.css"', read_file(os.path.join(self.dest, "index.html")))
+
+
+class TestMinify(unittest.TestCase):
+    def test_collapses_whitespace_and_drops_comments(self):
+        html = "<html>\n  <head>\n    <title>T</title>\n  </head>\n  <!-- note -->\n  <body><p>a  \n b</p></body>\n</html>"
+        self.assertEqual(
+            minify_html(html), "<html><head><title>T</title></head><body><p>a b</p></body></html>"
+        )
+
+    def test_keeps_spaces_between_inline_elements(self):
+        html = "<p> <b>bold</b>  <i>italic</i> text <a href='/x'>link</a> </p>"
+        self.assertEqual(
+            minify_html(html), "<p><b>bold</b> <i>italic</i> text <a href='/x'>link</a></p>"
+        )
+
+    def test_pre_and_code_are_untouched(self):
+        html = "<pre><code>a  \n\n  <b>x</b>  <!-- kept --></code></pre>\n<p>see <code> a  b </code></p>"
+        self.assertEqual(
+            minify_html(html),
+            "<pre><code>a  \n\n  <b>x</b>  <!-- kept --></code></pre><p>see <code> a  b </code></p>",
+        )
+
+    def test_stray_angle_brackets_are_text(self):
+        self.assertEqual(minify_html("<p>1  < 2 and <3</p>"), "<p>1 < 2 and <3</p>")
+
+    def test_unclosed_tag_or_comment_is_not_buffered_to_the_end(self):
+        for fragment in ["<p>if n<max it's fine</p>", "<p>a <!-- b</p>"]:
+            with self.subTest(fragment=fragment):
+                chunks = [fragment] + ["<p>some  words</p>\n"] * 2000
+                out = []
+                minifier = HTMLMinifier(out.append)
+                longest = 0
+                for chunk in chunks:
+                    minifier.feed(chunk)
+                    longest = max(longest, len(minifier.buffer))
+                minifier.close()
+                self.assertLessEqual(longest, 4096 + 20)
+                self.assertEqual("".join(out), minify_html("".join(chunks)))
+                self.assertTrue("".join(out).startswith(fragment + "<p>some words</p><p>"))
+
+    def test_chunked_input_matches_whole_input(self):
+        html = read_file(os.path.join(os.path.dirname(__file__), "..", "template.html"))
+        html = html.replace("{{ Content }}", "<pre><code>x  y\n</code></pre> <!-- c --> <b>b</b>")
+        for size in [1, 2, 3, 7, 64]:
+            out = []
+            minifier = HTMLMinifier(out.append)
+            for start in range(0, len(html), size):
+                minifier.feed(html[start : start + size])
+            minifier.close()
+            self.assertEqual("".join(out), minify_html(html))
+            self.assertEqual(minifier.size, len(html.encode("utf-8")))
+
+
+class TestMinifiedBuild(SiteTestCase):
+    def build(self, **options):
+        return capture_log(
+            generate_pages_recursive, self.content, self.template, self.dest, "/",
+            minify=True, **options
+        )
+
+    def test_pages_are_minified_and_savings_reported(self):
+        write_file(self.template, "<html>\n  <title>{{ Title }}</title>\n  <main>{{ Content }}</main>\n</html>")
+        messages = self.build()
+        self.assertEqual(
+            read_file(os.path.join(self.dest, "index.html")),
+            '<html><title>Home</title><main><div><h1>Home</h1><p><a href="/blog/post">Post</a></p></div></main></html>',
+        )
+        self.assertIn("Minified 2 pages: 0.0 kB saved", messages[-1])
+        self.assertTrue(any(message.endswith("(7 saved)") for message in messages))
+
+    def test_every_pipeline_writes_the_same_pages(self):
+        write_file(self.template, "<html>\n  <main>{{ Content }}</main>\n</html>")
+        self.build()
+        expected = read_file(os.path.join(self.dest, "blog", "post", "index.html"))
+        for options in [{"jobs": 2}, {"io_concurrency": 2}]:
+            shutil.rmtree(self.dest)
+            messages = self.build(**options)
+            self.assertIn("Minified 2 pages", messages[-1])
+            self.assertEqual(read_file(os.path.join(self.dest, "blog", "post", "index.html")), expected)
+
+
+    def test_toggling_minify_rebuilds_incremental_pages(self):
+        manifest = os.path.join(self.root, ".ssg-cache", "manifest.json")
+        for minify, rebuilt in [(True, True), (True, False), (False, True)]:
+            messages = capture_log(
+                build_incremental, self.content, self.template, self.static, self.dest, "/",
+                manifest, minify=minify,
+            )
+            self.assertEqual(any("Generated 2 pages" in message for message in messages), rebuilt)
+
+
+def png_header(width, height):
+    return b"\x89PNG\r\n\x1a\n" + b"\x00\x00\x00\x0dIHDR" + struct.pack(">II", width, height) + b"\x08\x02"
+
+
+class TestImageSize(unittest.TestCase):
+    def probe(self, data):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "image")
+            with open(path, "wb") as f:
+                f.write(data)
+            return image_size(path)
+
+    def test_png(self):
+        self.assertEqual(self.probe(png_header(640, 480) + b"\x00" * 100), [640, 480])
+
+    def test_gif(self):
+        self.assertEqual(self.probe(b"GIF89a" + struct.pack("<HH", 16, 9) + b"\x00" * 20), [16, 9])
+
+    def test_jpeg_skips_segments_before_the_frame(self):
+        app0 = b"\xff\xe0" + struct.pack(">H", 16) + b"JFIF\x00" + b"\x00" * 9
+        sof = b"\xff\xc0" + struct.pack(">HBHH", 17, 8, 300, 400) + b"\x00" * 10
+        self.assertEqual(self.probe(b"\xff\xd8" + app0 + sof + b"\xff\xd9"), [400, 300])
+
+    def test_webp(self):
+        def riff(chunk):
+            return b"RIFF" + struct.pack("<I", 100) + b"WEBP" + chunk + b"\x00" * 16
+
+        lossy = b"VP8 " + b"\x00" * 4 + b"\x00\x00\x00\x9d\x01\x2a" + struct.pack("<HH", 320, 200)
+        self.assertEqual(self.probe(riff(lossy)), [320, 200])
+        bits = (320 - 1) | ((200 - 1) << 14)
+        lossless = b"VP8L" + b"\x00" * 4 + b"\x2f" + bits.to_bytes(4, "little")
+        self.assertEqual(self.probe(riff(lossless)), [320, 200])
+        extended = b"VP8X" + b"\x00" * 8 + (319).to_bytes(3, "little") + (199).to_bytes(3, "little")
+        self.assertEqual(self.probe(riff(extended)), [320, 200])
+
+    def test_unknown_or_truncated(self):
+        self.assertIsNone(self.probe(b"not an image"))
+        self.assertIsNone(self.probe(b"\xff\xd8\xff\xe0\x00"))
+        self.assertIsNone(self.probe(b"GIF89a"))
+        self.assertIsNone(self.probe(png_header(640, 480)[:16]))
+        self.assertIsNone(self.probe(b"RIFF\x00\x00\x00\x00WEBPVP8L\x00\x00\x00\x00\x2f"))
+        self.assertIsNone(self.probe(b"\xff\xd8\xff\xe0\x00\x00\xff\xc0"))
+
+
+class TestImageSizeCache(SiteTestCase):
+    def setUp(self):
+        super().setUp()
+        self.image = os.path.join(self.static, "images", "a.png")
+        with open(self.image, "wb") as f:
+            f.write(png_header(640, 480))
+        self.cache_path = os.path.join(self.root, ".ssg-cache", "images.json")
+
+    def sizes(self):
+        cache = ImageSizeCache(self.cache_path)
+        messages = capture_log(cache.image_sizes, self.static)
+        cache.save()
+        return cache, messages[-1]
+
+    def test_images_are_probed_once_across_builds(self):
+        cache, message = self.sizes()
+        self.assertEqual(message, "Image sizes: 1 images, 1 probed")
+        cache, message = self.sizes()
+        self.assertEqual(message, "Image sizes: 1 images, 0 probed")
+
+        with open(self.image, "wb") as f:
+            f.write(png_header(32, 32))
+        os.utime(self.image, ns=(1, 1))
+        cache, message = self.sizes()
+        self.assertEqual(message, "Image sizes: 1 images, 1 probed")
+        self.assertEqual(list(cache.sizes.values()), [[32, 32]])
+
+    def test_unreadable_image_is_skipped_with_one_warning(self):
+        with open(self.image, "wb") as f:
+            f.write(b"GIF89a")
+        cache = ImageSizeCache(self.cache_path)
+        messages = capture_log(cache.image_sizes, self.static)
+        self.assertEqual(messages[0], f"Warning: could not read the dimensions of {self.image}")
+        self.assertEqual(messages[-1], "Image sizes: 0 images, 1 probed")
+        cache.save()
+        messages = capture_log(ImageSizeCache(self.cache_path).image_sizes, self.static)
+        self.assertEqual(messages, ["Image sizes: 0 images, 0 probed"])
+
+    def test_img_tags_get_dimensions_and_lazy_loading(self):
+        sizes = {}
+        capture_log(lambda: sizes.update(ImageSizeCache(self.cache_path).image_sizes(self.static)))
+        assets = asset_manifest({}, sizes)
+        html = markdown_to_html_node("![A](/images/a.png) ![B](/images/b.png)", "/", assets=assets).to_html()
+        self.assertEqual(
+            html,
+            '<div><p><img src="/images/a.png" alt="A" width="640" height="480" loading="lazy">'
+            ' <img src="/images/b.png" alt="B"></p></div>',
+        )
+
+    def test_incremental_build_rebuilds_when_sizes_turn_on_or_change(self):
+        manifest = os.path.join(self.root, ".ssg-cache", "manifest.json")
+        write_file(os.path.join(self.content, "index.md"), "# Home\n\n![A](/images/a.png)")
+        home = os.path.join(self.dest, "index.html")
+
+        def build(sizes):
+            return "\n".join(capture_log(
+                build_incremental, self.content, self.template, self.static, self.dest, "/",
+                manifest, explain=True, image_sizes=sizes,
+            ))
+
+        build(None)
+        self.assertIn("image sizes turned on or off", build({"/images/a.png": [640, 480]}))
+        self.assertIn('width="640" height="480" loading="lazy"', read_file(home))
+        # A resized image is a changed asset, so the pages using it rebuild
+        with open(self.image, "wb") as f:
+            f.write(png_header(32, 32))
+        build({"/images/a.png": [32, 32]})
+        self.assertIn('width="32" height="32"', read_file(home))
+
+
+class TestSiteWatcher(SiteTestCase):
+    def setUp(self):
+        super().setUp()
+        with redirect_stdout(io.StringIO()):
+            generate_pages_recursive(self.content, self.template, self.dest, "/")
+        self.watcher = SiteWatcher(
+            self.content, self.template, self.static, self.dest, "/"
+        )
+
+    def poll(self):
+        with redirect_stdout(io.StringIO()):
+            return self.watcher.poll()
+
+    def test_no_changes(self):
+        self.assertEqual(self.poll(), [])
+
+    def test_changed_page_is_regenerated(self):
+        write_file(os.path.join(self.content, "index.md"), "# Home\n\nA longer edit")
+        self.assertEqual(self.poll(), [os.path.join(self.dest, "index.html")])
+        self.assertIn("A longer edit", read_file(os.path.join(self.dest, "index.html")))
+
+    def test_template_change_regenerates_every_page(self):
+        write_file(self.template, "<h1>{{ Title }}</h1>{{ Content }}")
+        self.assertEqual(len(self.poll()), 2)
+        self.assertTrue(
+            read_file(os.path.join(self.dest, "index.html")).startswith("<h1>Home</h1>")
+        )
+
+    def test_removed_page_output_is_deleted(self):
+        os.remove(os.path.join(self.content, "blog", "post", "index.md"))
+        self.poll()
+        self.assertFalse(os.path.exists(os.path.join(self.dest, "blog")))
+
+    def test_changed_asset_is_copied(self):
+        write_file(os.path.join(self.static, "images", "b.png"), "new")
+        self.assertEqual(self.poll(), [os.path.join(self.dest, "images", "b.png")])
+
+    def test_broken_page_does_not_stop_watcher(self):
+        write_file(os.path.join(self.content, "index.md"), "no title here")
+        generated = []
+        messages = capture_log(lambda: generated.extend(self.watcher.poll()))
+        self.assertEqual(generated, [])
+        self.assertTrue(any("could not generate" in message for message in messages))
+
+    def test_diff_snapshots(self):
+        old = snapshot_files(self.content)
+        write_file(os.path.join(self.content, "new.md"), "# New")
+        os.remove(os.path.join(self.content, "index.md"))
+        changed, removed = diff_snapshots(old, snapshot_files(self.content))
+        self.assertEqual(changed, [os.path.join(self.content, "new.md")])
+        self.assertEqual(removed, [os.path.join(self.content, "index.md")])
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_make_document_respects_mix(self):
+        markdown = make_document(30, mix={"code": 1})
+        blocks = markdown_to_blocks(markdown)
+        self.assertEqual(len(blocks), 31)
+        self.assertTrue(all(block.startswith("```") for block in blocks[1:]))
+
+    def test_make_document_is_deterministic(self):
+        self.assertEqual(make_document(20, seed=3), make_document(20, seed=3))
+
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix("paragraph=3,code"), {"paragraph": 3.0, "code": 1.0})
+
+    def test_compare_reports_flags_regressions(self):
+        baseline = {"results": {"build": {"seconds": 1.0}, "to_html": {"seconds": 1.0}}}
+        current = {"results": {"build": {"seconds": 1.5}, "to_html": {"seconds": 1.05}}}
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(compare_reports(baseline, current, 0.1), ["build"])
+
+
 if __name__ == "__main__":
     unittest.main()
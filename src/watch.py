@@ -0,0 +1,182 @@
+import os
+import time
+import logging
+import threading
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from functions import (
+    generate_page,
+    load_template,
+    remove_output,
+    collect_pages,
+    page_dest_path,
+    sync_file,
+    log_copied,
+)
+from log import logger, log_event
+from minify import MinifyReport
+
+
+# Polling file watcher
+def snapshot_files(root):
+    snapshot = {}
+    pending = [root]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    pending.append(entry.path)
+                elif entry.is_file():
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        # Deleted between listing and stat, e.g. an editor swap file
+                        continue
+                    snapshot[entry.path] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+def diff_snapshots(old, new):
+    changed = sorted(path for path, stamp in new.items() if old.get(path) != stamp)
+    removed = sorted(path for path in old if path not in new)
+    return changed, removed
+
+
+class SiteWatcher:
+    def __init__(
+        self,
+        dir_path_content,
+        template_path,
+        dir_path_static,
+        dest_dir_path,
+        basepath,
+        cache=None,
+        block_cache=None,
+        minify=False,
+    ):
+        self.dir_path_content = dir_path_content
+        self.template_path = template_path
+        self.dir_path_static = dir_path_static
+        self.dest_dir_path = dest_dir_path
+        self.basepath = basepath
+        self.cache = cache
+        self.block_cache = block_cache
+        self.minify = minify
+
+        # The parsed template and the file stamps live for the whole session
+        self.template = load_template(template_path, basepath)
+        self.template_stamp = self.stamp(template_path)
+        self.content = snapshot_files(dir_path_content)
+        self.static = snapshot_files(dir_path_static)
+
+    @staticmethod
+    def stamp(path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def poll(self):
+        generated = []
+
+        # Editors that save by rename briefly remove the template; keep the old one
+        template_stamp = self.stamp(self.template_path)
+        rebuild_all = template_stamp not in (None, self.template_stamp)
+        if rebuild_all:
+            self.template = load_template(self.template_path, self.basepath)
+            self.template_stamp = template_stamp
+
+        content = snapshot_files(self.dir_path_content)
+        changed, removed = diff_snapshots(self.content, content)
+        self.content = content
+
+        if rebuild_all:
+            pages = collect_pages(self.dir_path_content, self.dest_dir_path)
+        else:
+            pages = [
+                (path, page_dest_path(path, self.dir_path_content, self.dest_dir_path))
+                for path in changed
+                if path.endswith(".md")
+            ]
+
+        report = MinifyReport() if self.minify else None
+        for from_path, dest_path in pages:
+            try:
+                generate_page(
+                    from_path,
+                    self.template_path,
+                    dest_path,
+                    self.basepath,
+                    template=self.template,
+                    cache=self.cache,
+                    block_cache=self.block_cache,
+                    minify=report,
+                )
+            except Exception as e:
+                # A half-written page must not bring the dev server down
+                logger.error(f"Error: could not generate {from_path}: {e}")
+                continue
+            generated.append(dest_path)
+        if report is not None and report.pages:
+            report.log()
+        # The page cache is trimmed after each rebuild, as after a full build
+        if pages and self.cache is not None:
+            self.cache.trim()
+
+        for from_path in removed:
+            if from_path.endswith(".md"):
+                remove_output(
+                    page_dest_path(
+                        from_path, self.dir_path_content, self.dest_dir_path
+                    ),
+                    self.dest_dir_path,
+                )
+
+        static = snapshot_files(self.dir_path_static)
+        changed, removed = diff_snapshots(self.static, static)
+        self.static = static
+
+        for src_path in changed:
+            dest_path = os.path.join(
+                self.dest_dir_path, os.path.relpath(src_path, self.dir_path_static)
+            )
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            if sync_file(src_path, dest_path):
+                log_copied(src_path, os.path.dirname(dest_path))
+                generated.append(dest_path)
+
+        for src_path in removed:
+            remove_output(
+                os.path.join(
+                    self.dest_dir_path, os.path.relpath(src_path, self.dir_path_static)
+                ),
+                self.dest_dir_path,
+            )
+
+        return generated
+
+    def run(self, interval):
+        while True:
+            time.sleep(interval)
+            start = time.perf_counter()
+            generated = self.poll()
+            if generated:
+                elapsed = (time.perf_counter() - start) * 1000
+                log_event(
+                    logging.INFO,
+                    "rebuild",
+                    f"Rebuilt {len(generated)} file(s) in {elapsed:.1f} ms",
+                    files=len(generated),
+                    milliseconds=elapsed,
+                )
+
+
+# Development server
+def serve_directory(directory, port):
+    handler = partial(SimpleHTTPRequestHandler, directory=directory)
+    server = ThreadingHTTPServer(("", port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info(f"Serving {directory} at http://localhost:{port}/")
+    return server